@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# Copyright (c) 2022 José Manuel Barroso Galindo <theypsilon@gmail.com>
+
+import copy
+import io
+import os
+import json
+import random
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager, redirect_stdout
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from db_operator import BuildOptions, BuildVars, DatabaseBuilder, DatabasePersistence, DownloadCache, Finder, HashCache, Tags, XmlFieldsCache, ZipsBuilder
+from db_operator import ArtifactStore, describe_files, initial_filter_aliases, run_stdout, save_zips, try_read_json
+
+def main() -> None:
+    parser = ArgumentParser(description='Times every phase of db_operator.py build over synthetic MiSTer trees.')
+    parser.add_argument('--files', type=int, nargs='+', default=[10000], help="Amount of files of each synthetic tree, like: 10000 50000 200000")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="Worker threads, same as 'db_operator.py build --jobs'")
+    parser.add_argument('--rounds', type=int, default=1, help="Measured rounds per tree, the best time of each phase is reported")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    zips_config = try_read_json(str(Path(__file__).parent / 'zips_config.json'))
+    if zips_config is None:
+        raise ValueError('Need "zips_config.json" next to this script!')
+
+    results: Dict[str, Any] = {'commit': current_commit(), 'python': sys.version.split()[0], 'jobs': args.jobs, 'rounds': args.rounds, 'trees': {}}
+    cwd = os.getcwd()
+    for files in args.files:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            total_size = create_synthetic_tree(temp_dir, files)
+            os.chdir(temp_dir)
+            try:
+                phases = benchmark_tree(zips_config, args.jobs, args.rounds)
+            finally:
+                os.chdir(cwd)
+        results['trees'][str(files)] = {'files': files, 'bytes': total_size, 'phases': phases}
+
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+def current_commit() -> str:
+    try:
+        return run_stdout('git rev-parse --verify HEAD', cwd=str(Path(__file__).parent))
+    except Exception:
+        return ''
+
+# Share of the tree for each kind of file, shaped after a MiSTer distribution.
+# Cheats and palettes are the bulk, followed by MRAs and their alternatives.
+mister_tree_shape: List[Tuple[str, float]] = [
+    ('cheats', 0.40),
+    ('palettes', 0.12),
+    ('mras', 0.18),
+    ('alternatives', 0.12),
+    ('mgls', 0.03),
+    ('arcade_rbfs', 0.02),
+    ('console_rbfs', 0.02),
+    ('computer_rbfs', 0.01),
+    ('filters', 0.05),
+    ('gamma', 0.01),
+    ('shadow_masks', 0.01),
+    ('fonts', 0.005),
+    ('docs', 0.025),
+]
+
+cheat_systems = ['NES', 'SNES', 'GB', 'GBC', 'GBA', 'Genesis', 'SMS', 'PSX', 'MegaCD', 'TGFX16']
+palette_systems = ['NES', 'GAMEBOY', 'GAMEBOY2P', 'GBC', 'MegaDuck', 'ATARI7800', 'Atari2600']
+console_cores = ['NES', 'SNES', 'Genesis', 'MegaCD', 'SMS', 'GAMEBOY', 'GBA', 'TurboGrafx16', 'PSX', 'Atari7800']
+computer_cores = ['C64', 'Amiga', 'ao486', 'MSX', 'ZX-Spectrum', 'AtariST', 'Apple-II', 'X68000']
+
+def create_synthetic_tree(directory: str, files: int) -> int:
+    # Same amount of files always yields the same tree, byte by byte.
+    rng = random.Random(files)
+    counts = [int(files * share) for _, share in mister_tree_shape]
+    counts[0] += files - sum(counts)
+    arcade_cores = [f'core{i}' for i in range(max(1, counts[5]))]
+
+    total_size = 0
+    for (kind, _), count in zip(mister_tree_shape, counts):
+        for i in range(count):
+            path, data = synthetic_file(kind, i, rng, arcade_cores)
+            target = Path(directory, path)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+            total_size += len(data)
+    return total_size
+
+def synthetic_file(kind: str, i: int, rng: random.Random, arcade_cores: List[str]) -> Tuple[str, bytes]:
+    if kind == 'cheats':
+        return f'Cheats/{rng.choice(cheat_systems)}/Game {i} [{rng.getrandbits(32):08X}].zip', random_bytes(rng, 64, 2048)
+    elif kind == 'palettes':
+        return f'games/{rng.choice(palette_systems)}/Palettes/Group {i % 16}/Palette {i}.pal', random_bytes(rng, 48, 192)
+    elif kind == 'mras':
+        return f'_Arcade/Game {i} ({1978 + i % 20}).mra', mra_bytes(rng, i, arcade_cores)
+    elif kind == 'alternatives':
+        return f'_Arcade/_alternatives/_Game {i // 4}/Game {i // 4} (rev {i % 4}).mra', mra_bytes(rng, i // 4, arcade_cores)
+    elif kind == 'mgls':
+        core = rng.choice(console_cores)
+        return f'_Console/{core} Game {i}.mgl', f'<mistergamedescription><rbf>_Console/{core}</rbf><setname>{core}{i}</setname></mistergamedescription>'.encode()
+    elif kind == 'arcade_rbfs':
+        return f'_Arcade/cores/{arcade_cores[i]}_{rbf_date(rng)}.rbf', random_bytes(rng, 8 * 1024, 32 * 1024)
+    elif kind == 'console_rbfs':
+        return f'_Console/{console_cores[i % len(console_cores)]}_{rbf_date(rng)}.rbf', random_bytes(rng, 8 * 1024, 32 * 1024)
+    elif kind == 'computer_rbfs':
+        return f'_Computer/{computer_cores[i % len(computer_cores)]}_{rbf_date(rng)}.rbf', random_bytes(rng, 8 * 1024, 32 * 1024)
+    elif kind == 'filters':
+        folder = rng.choice(['Filters', 'Filters/Scanlines', 'Filters/Upscaling', 'Filters_Audio'])
+        return f'{folder}/Filter {i}.txt', random_bytes(rng, 256, 1024)
+    elif kind == 'gamma':
+        return f'Gamma/Gamma {i}.txt', random_bytes(rng, 256, 1024)
+    elif kind == 'shadow_masks':
+        return f'Shadow_Masks/Mask {i}.txt', random_bytes(rng, 64, 512)
+    elif kind == 'fonts':
+        return f'font/font{i}.pf', random_bytes(rng, 1024, 4096)
+    elif kind == 'docs':
+        return f'docs/{rng.choice(console_cores + computer_cores)}/doc{i}.md', random_bytes(rng, 512, 4096)
+    else:
+        raise ValueError(kind)
+
+def mra_bytes(rng: random.Random, game: int, arcade_cores: List[str]) -> bytes:
+    rom = f'<rom index="0" zip="game{game}.zip|parent{game // 8}.zip" md5="None"><part>{"AA " * rng.randint(16, 256)}</part></rom>'
+    return f'<misterromdescription><name>Game {game}</name><setname>game{game}</setname><rbf>{rng.choice(arcade_cores)}</rbf>{rom}</misterromdescription>'.encode()
+
+def rbf_date(rng: random.Random) -> str:
+    return f'{rng.randint(2019, 2022)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}'
+
+def random_bytes(rng: random.Random, min_size: int, max_size: int) -> bytes:
+    size = rng.randint(min_size, max_size)
+    return rng.getrandbits(size * 8).to_bytes(size, 'little')
+
+def benchmark_tree(zips_config: Dict[str, Any], jobs: int, rounds: int) -> Dict[str, float]:
+    best: Dict[str, float] = {}
+    for _ in range(rounds):
+        for phase, seconds in run_build_phases(zips_config, jobs).items():
+            best[phase] = min(best.get(phase, seconds), seconds)
+    return best
+
+def run_build_phases(zips_config: Dict[str, Any], jobs: int) -> Dict[str, float]:
+    # Same steps as build_database with every cache disabled, so each round starts cold.
+    timings: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(name: str) -> Iterator[None]:
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            yield
+            timings[name] = time.perf_counter() - start
+
+    with phase('find_all'):
+        finder = Finder('.')
+        finder.ignore_folder('./.git')
+        finder.ignore_folder('./.github')
+        all_files = finder.find_all()
+
+    tags = Tags(None, XmlFieldsCache(None))
+    tags.init_aliases(initial_filter_aliases)
+    builder = DatabaseBuilder(tags)
+    db_files = [file for file in all_files if builder.accepts_file(file)]
+
+    with phase('hashing'):
+        descriptions = describe_files(db_files, HashCache(None), jobs, {}, finder.stats)
+
+    with phase('tags'):
+        files_terms = tags.extract_files_terms(db_files, [description['hash'] for description in descriptions], jobs)
+        for file, description, file_terms in zip(db_files, descriptions, files_terms):
+            builder.add_file(file, description, file_terms)
+
+    with phase('add_parent_folders'):
+        for file in all_files:
+            builder.add_parent_folders(file)
+
+    db = builder.build(db_id='benchmark')
+    db['base_files_url'] = 'https://example.com/benchmark/'
+    with phase('zips_builder'):
+        zips_builder = ZipsBuilder(db)
+        for zip_id, zip_description in zips_config.items():
+            zips_builder.add_zip(zip_id, zip_description)
+        db['zips'] = zips_builder.build()
+
+    # The saved db plays the role of the published one, and an identical rebuild is compared against it.
+    rebuilt_db = copy.deepcopy(db)
+    with phase('save_zips'):
+        save_zips(db['zips'], 'https://example.com/%s/', jobs, {}, ArtifactStore(''))
+
+    with phase('needs_save'):
+        options = BuildOptions(hash_cache=False, xml_cache=False, download_cache=False, jobs=jobs)
+        DatabasePersistence(rebuilt_db, BuildVars(), options, DownloadCache(None), previous_db=db).needs_save()
+
+    # Keeps the next round from finding the zips of this one.
+    for zip_id in db['zips']:
+        for name in [f'{zip_id}_summary.json.zip', f'{zip_id}.zip']:
+            os.remove(name)
+
+    return timings
+
+def print_results(results: Dict[str, Any]) -> None:
+    print(f'commit {results["commit"] or "unknown"}, python {results["python"]}, {results["jobs"]} jobs')
+    print(f'{"files":>8} {"MB":>8} {"phase":<20} {"seconds":>9} {"us/file":>9}')
+    for tree in results['trees'].values():
+        for phase, seconds in tree['phases'].items():
+            print(f'{tree["files"]:>8} {tree["bytes"] / 1000000:>8.1f} {phase:<20} {seconds:>9.3f} {seconds / tree["files"] * 1000000:>9.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Copyright (c) 2022 José Manuel Barroso Galindo <theypsilon@gmail.com>
+
+import os
+import json
+import random
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from db_operator import hash_backends
+
+def main() -> None:
+    parser = ArgumentParser(description='Compares the hashing backends of db_operator.py across file size distributions.')
+    parser.add_argument('--tree', help="Benchmark the files of an existing MiSTer tree instead of a synthetic one")
+    parser.add_argument('--scale', type=float, default=0.05, help="Multiplier for the amount of files of the synthetic distribution, 1.0 is about the size of a full MiSTer distribution (~2 GB)")
+    parser.add_argument('--rounds', type=int, default=3, help="Measured rounds per backend, the best one is reported")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.tree is not None:
+        results = benchmark_tree(args.tree, args.rounds)
+    else:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            results = benchmark_tree(create_synthetic_tree(temp_dir, args.scale), args.rounds)
+
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+# Size buckets shaped after a MiSTer distribution: lots of tiny palettes and cheats,
+# thousands of small MRAs, a few hundred multi-MB RBFs and a single big Linux release.
+# At scale 1.0 it weighs about 2 GB, so by default only a small fraction of it is written.
+mister_size_distribution: List[Tuple[str, int, int, int]] = [
+    # (bucket, count, min size, max size)
+    ('tiny', 6000, 64, 4 * 1024),
+    ('small', 4000, 4 * 1024, 64 * 1024),
+    ('medium', 600, 64 * 1024, 1024 * 1024),
+    ('large', 400, 1024 * 1024, 8 * 1024 * 1024),
+    ('huge', 1, 32 * 1024 * 1024, 32 * 1024 * 1024),
+]
+
+def create_synthetic_tree(directory: str, scale: float) -> str:
+    rng = random.Random(0)
+    for bucket, count, min_size, max_size in mister_size_distribution:
+        folder = Path(directory, bucket)
+        folder.mkdir(parents=True, exist_ok=True)
+        for i in range(max(1, int(count * scale))):
+            with open(folder / f'{i}.bin', 'wb') as f:
+                f.write(os.urandom(rng.randint(min_size, max_size)))
+    return directory
+
+def benchmark_tree(directory: str, rounds: int) -> Dict[str, Any]:
+    buckets = bucket_files(directory)
+    results: Dict[str, Any] = {'tree': directory, 'rounds': rounds, 'buckets': {}}
+    for bucket, files in buckets.items():
+        total_size = sum(size for _, size in files)
+        bucket_result: Dict[str, Any] = {'files': len(files), 'bytes': total_size, 'backends': {}}
+        for backend, hash_fn in sorted(hash_backends.items()):
+            for file, _ in files:
+                hash_fn(file)
+
+            best = None
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for file, _ in files:
+                    hash_fn(file)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            bucket_result['backends'][backend] = {
+                'seconds': best,
+                'mb_per_second': total_size / best / 1000000 if best else 0,
+                'us_per_file': best / len(files) * 1000000,
+            }
+        results['buckets'][bucket] = bucket_result
+    return results
+
+def bucket_files(directory: str) -> Dict[str, List[Tuple[str, int]]]:
+    buckets: Dict[str, List[Tuple[str, int]]] = {bucket: [] for bucket, _, _, _ in mister_size_distribution}
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d not in ['.git', '.github']]
+        for name in files:
+            path = os.path.join(root, name)
+            size = os.path.getsize(path)
+            for bucket, _, _, max_size in mister_size_distribution:
+                if size <= max_size or bucket == mister_size_distribution[-1][0]:
+                    buckets[bucket].append((path, size))
+                    break
+    return {bucket: files for bucket, files in buckets.items() if len(files) > 0}
+
+def print_results(results: Dict[str, Any]) -> None:
+    print(f'{"bucket":<8} {"files":>7} {"MB":>9} {"backend":<10} {"MB/s":>9} {"us/file":>10}')
+    for bucket, bucket_result in results['buckets'].items():
+        for backend, measure in bucket_result['backends'].items():
+            print(f'{bucket:<8} {bucket_result["files"]:>7} {bucket_result["bytes"] / 1000000:>9.1f} {backend:<10} {measure["mb_per_second"]:>9.1f} {measure["us_per_file"]:>10.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,6 @@
 
 import os
 from pathlib import Path
-import hashlib
 import json
 import time
 import re
@@ -17,6 +16,7 @@ import traceback
 from zipfile import ZipFile
 from inspect import currentframe, getframeinfo
 from typing import Dict, List, Any
+from shared_utilities import XmlFieldsCache, default_cache_dir, hash_backends
 
 _print = print
 def print(text=""):
@@ -46,7 +46,10 @@ def main(dryrun):
     check_test = os.getenv('CHECK_TEST', 'true') != 'false' 
     download_metadata_json = os.getenv('DOWNLOAD_METADATA_JSON', '/tmp/download_metadata.json')
 
-    tags = Tags(try_read_json(download_metadata_json, None))
+    xml_fields_cache = XmlFieldsCache(os.path.join(os.getenv('CACHE_DIR', default_cache_dir()), 'xml_fields_cache.json'))
+    xml_fields_cache.load()
+
+    tags = Tags(try_read_json(download_metadata_json, None), xml_fields_cache)
 
     db = create_db('.', {
         'sha': sha,
@@ -59,6 +62,8 @@ def main(dryrun):
         'linux_github_repository': os.getenv('LINUX_GITHUB_REPOSITORY', '').strip(),
         'zips_config': os.getenv('ZIPS_CONFIG', '').strip()
     }, tags)
+
+    xml_fields_cache.save()
     
     db['files'] = to_external_paths(db['files'])
     db['folders'] = to_external_paths(db['folders'])
@@ -168,8 +173,9 @@ class Metadata:
         return self._props['aliases']
 
 class Tags:
-    def __init__(self, metadata_props) -> None:
+    def __init__(self, metadata_props, xml_fields_cache=None) -> None:
         self._metadata = Metadata(metadata_props if metadata_props is not None else Metadata.new_props())
+        self._xml_fields = xml_fields_cache if xml_fields_cache is not None else XmlFieldsCache(None)
         self._dict = {}
         self._alternatives = {}
         self._index = 0
@@ -206,10 +212,10 @@ class Tags:
         self._index += 1
         return result
     
-    def get_tags_for_file(self, path: Path):
-        return sorted(self._get_tags_for_file(path))
+    def get_tags_for_file(self, path: Path, file_hash=None):
+        return sorted(self._get_tags_for_file(path, file_hash))
 
-    def _get_tags_for_file(self, path: Path):
+    def _get_tags_for_file(self, path: Path, file_hash):
         parent = path.parts[0].lower()
         if parent[0] == '|':
             parent = parent[1:]
@@ -227,7 +233,7 @@ class Tags:
 
         if suffix == '.mra':
             self._append(result, self._use_term('mra'))
-            rbf, zips = read_mra_fields(path)
+            rbf, zips = self._xml_fields.mra_fields(path, file_hash, read_mra_fields)
 
             if rbf is not None:
                 self._append(result, self._use_arcade_term(rbf))
@@ -262,7 +268,7 @@ class Tags:
             self._append(result, self._use_term('mgl'))
             self._append(result, self._use_term('cores'))
             self._append(result, self._use_term(stem))
-            rbf, setname = read_mgl_fields(path)
+            rbf, setname = self._xml_fields.mgl_fields(path, file_hash, read_mgl_fields)
             if rbf is not None:
                 self._append(result, self._use_term(Path(rbf).name.lower()))
 
@@ -435,7 +441,9 @@ class Tags:
 class Finder:
     def __init__(self, dir: str):
         self._dir = dir
-        self._not_in_directory = []
+        self._not_in_directory = set()
+        # Stats taken while walking, so files don't need to be stat-ed again for hashing.
+        self.stats = {}
 
     @property
     def dir(self):
@@ -444,18 +452,31 @@ class Finder:
     def ignore_folder(self, folder: str):
         directory = str(Path(folder))
         print('ignore_folder: %s' % directory)
-        self._not_in_directory.append(directory)
+        self._not_in_directory.add(directory)
 
     def find_all(self) -> List[Path]:
-        return sorted(self._scan(self._dir), key=lambda file: str(file).lower())
+        # Paths are composed as the same strings that Path(entry.path) would produce, with their lowercase sort keys next to them.
+        root = str(Path(self._dir))
+        files = []
+        pending = [(self._dir, '' if root == '.' else root + '/')]
+        while len(pending) > 0:
+            directory, prefix = pending.pop()
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    path = prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if path not in self._not_in_directory:
+                            pending.append((entry.path, path + '/'))
+                        continue
 
-    def _scan(self, directory: str) -> List[Path]:
-        for entry in os.scandir(directory):
-            if entry.is_dir(follow_symlinks=False):
-                if str(Path(entry.path)) not in self._not_in_directory:
-                    yield from self._scan(entry.path)
-            else:
-                yield Path(entry.path)
+                    files.append((path.lower(), path))
+                    try:
+                        self.stats[path] = entry.stat()
+                    except OSError:
+                        pass
+
+        files.sort()
+        return [Path(path) for _, path in files]
 
 
 class EmptyFinder(Finder):
@@ -713,10 +734,13 @@ def create_summary(finder: Finder, tags: Tags, source):
         if file.name in ['.delme'] or strfile in ['README.md', 'LICENSE', 'latest_linux.txt', '.gitattributes']:
             continue
 
+        stat = finder.stats.get(strfile)
+        file_size = stat.st_size if stat is not None else size(file)
+        file_hash = hash(file, file_size)
         summary["files"][strfile] = {
-            "size": size(file),
-            "hash": hash(file),
-            "tags": tags.get_tags_for_file(file)
+            "size": file_size,
+            "hash": file_hash,
+            "tags": tags.get_tags_for_file(file, file_hash)
         }
             
         file_name = file.name.lower()
@@ -889,14 +913,12 @@ def create_delete_list(strfile, regex):
     return []
 
 
-def hash(file):
-    with open(file, "rb") as f:
-        file_hash = hashlib.md5()
-        chunk = f.read(8192)
-        while chunk:
-            file_hash.update(chunk)
-            chunk = f.read(8192)
-        return file_hash.hexdigest()
+def hash(file, size=None):
+    return hash_backends[hash_backend](file, size)
+
+hash_backend = os.getenv('HASH_BACKEND', 'mmap')
+if hash_backend not in hash_backends:
+    raise ValueError(f'Unknown HASH_BACKEND "{hash_backend}", available backends: {", ".join(sorted(hash_backends))}')
 
 
 def size(file):
@@ -964,7 +986,7 @@ def read_mgl_fields(mgl_path):
                 if elem.text is None:
                     continue
                 rbf = elem.text.strip().lower()
-            elif setname == 'rom':
+            elif elem_tag == 'setname':
                 if setname is not None:
                     print('WARNING! Duplicated setname tag on file %s, first value %s, later value %s' % (str(mgl_path),setname,elem.text))
                     continue
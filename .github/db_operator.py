@@ -2,7 +2,12 @@
 # Copyright (c) 2022 José Manuel Barroso Galindo <theypsilon@gmail.com>
 
 import time
-from typing import Any, Dict, Generator, Iterator, List, Optional, Set, Tuple
+import threading
+import heapq
+import sys
+from multiprocessing.pool import ThreadPool
+from bisect import bisect_left
+from typing import Any, BinaryIO, Dict, Generator, Iterable, Iterator, List, Optional, Set, Tuple, cast
 from pathlib import Path
 import xml.etree.ElementTree as ET
 import io
@@ -14,26 +19,63 @@ import subprocess
 import shlex
 import tempfile
 from argparse import ArgumentParser
-from zipfile import ZipFile, ZIP_DEFLATED
+from zipfile import BadZipFile, ZipFile, ZipInfo, ZIP_DEFLATED
 from dataclasses import dataclass
+from contextlib import contextmanager
+from shared_utilities import HttpException, XmlFieldsCache, default_cache_dir, hash_backends, http_transport, profiler
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
 
 def main() -> None:
     start = time.time()
 
     parser = ArgumentParser()
+    parser.add_argument('--profile', choices=['cpu', 'memory'], help="Profile the whole run with cProfile (main thread only, combine with --jobs 1 for the workers), or take tracemalloc snapshots after every build phase")
     subparsers = parser.add_subparsers(dest='command', required=True)
-    subparsers.add_parser('build').add_argument('source_dir', default='delme', help="Folder with the content that will be in the Database")
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('source_dir', default='delme', help="Folder with the content that will be in the Database")
+    build_parser.add_argument('--no-hash-cache', action='store_true', help="Hash every file again instead of reusing the hashes stored in the hash cache")
+    build_parser.add_argument('--no-xml-cache', action='store_true', help="Parse every MRA and MGL again instead of reusing the fields stored in the XML cache")
+    build_parser.add_argument('--no-download-cache', action='store_true', help="Download the previous db and its summaries again instead of reusing the local copies")
+    build_parser.add_argument('--incremental', action='store_true', help="Reuse the hashes of the previous db for the files that git reports as unchanged")
+    build_parser.add_argument('--show-diff', action='store_true', help="Print the differences with the previous db, if any")
+    build_parser.add_argument('--hash-backend', choices=sorted(hash_backends), default=default_hash_backend, help="Strategy used to read files while hashing them")
+    build_parser.add_argument('--json-serializer', choices=sorted(json_serializers), default=default_json_serializer, help="Strategy used to write db.json and db.json.zip")
+    build_parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help="Amount of files hashed concurrently")
+    build_parser.add_argument('--trace', help="Write the timings of every build phase to this file, as Chrome trace events")
+    build_parser.add_argument('--trace-top', type=int, default=10, help="Amount of slowest files reported per kind when tracing")
+    xml_cache_parser = subparsers.add_parser('xml-cache')
+    xml_cache_parser.add_argument('action', choices=['list', 'prune'], help="List the cached MRA/MGL fields, or prune the ones not used recently")
+    xml_cache_parser.add_argument('--max-age-days', type=int, default=30, help="Entries not used by any build in this amount of days get pruned")
     compare_parser = subparsers.add_parser('compare')
     compare_parser.add_argument('left_db', help="Address pointing to Database")
     compare_parser.add_argument('right_db', help="Address pointing to another Database")
+    compare_parser.add_argument('--format', choices=['text', 'json'], default='text', help="Print the differences as human readable text or as JSON")
+    compare_parser.add_argument('--output', help="Write the differences to this file instead of the standard output")
+    compare_parser.add_argument('--no-download-cache', action='store_true', help="Download both dbs and their summaries again instead of reusing the local copies")
     args = parser.parse_args()
 
+    profiler.start(args.profile)
     if args.command == 'build':
-        build_database(args.source_dir)
+        set_hash_backend(args.hash_backend)
+        set_json_serializer(args.json_serializer)
+        if args.trace is not None:
+            tracer.enable(args.trace_top)
+        build_database(args.source_dir, BuildOptions(hash_cache=not args.no_hash_cache, xml_cache=not args.no_xml_cache, download_cache=not args.no_download_cache, jobs=max(1, args.jobs), incremental=args.incremental, show_diff=args.show_diff))
+        if args.trace is not None:
+            tracer.print_report()
+            tracer.write(args.trace)
+    elif args.command == 'xml-cache':
+        manage_xml_cache(args.action, args.max_age_days)
     elif args.command == 'compare':
-        compare_databases(args.left_db, args.right_db)
+        compare_databases(args.left_db, args.right_db, download_cache=not args.no_download_cache, format=args.format, output=args.output)
     else:
         raise ValueError(args.command)
+    http_transport.close()
+    profiler.stop()
+    profiler.print_report()
 
     print()
     print("Time:")
@@ -43,51 +85,126 @@ def main() -> None:
 
 # Entrypoints for the different Use Cases:
 
-def build_database(source_dir: str):
+def build_database(source_dir: str, options: 'BuildOptions'):
     print('Building database...')
     print()
     vars = BuildVars()
     print('BuildVars:', json.dumps(vars.__dict__, indent=True))
+    print('BuildOptions:', json.dumps(options.__dict__, indent=True))
     if vars.db_id == '':
         raise ValueError(f'Variable "DB_ID" is missing!')
 
+    hash_cache_path = str(Path(vars.cache_dir, 'hash_cache.json').absolute()) if options.hash_cache else None
+    xml_cache_path = str(Path(vars.cache_dir, XmlFieldsCache.file_name).absolute()) if options.xml_cache else None
+    download_cache_dir = str(Path(vars.cache_dir, DownloadCache.dir_name).absolute()) if options.download_cache else None
     set_source_dir(source_dir)
 
-    finder = Finder('.')
-    finder.ignore_folder('./.git')
-    finder.ignore_folder('./.github')
-    all_files = finder.find_all()
-
-    tags = Tags(try_read_json(vars.download_metadata_json))
+    with tracer.span('load caches'):
+        hash_cache = HashCache(hash_cache_path)
+        hash_cache.load()
+        xml_fields_cache = XmlFieldsCache(xml_cache_path)
+        xml_fields_cache.load()
+        download_cache = DownloadCache(download_cache_dir)
+
+    with tracer.span('find_all') as span:
+        finder = Finder('.')
+        finder.ignore_folder('./.git')
+        finder.ignore_folder('./.github')
+        all_files = finder.find_all()
+        span.count(files=len(all_files))
+
+    tags = Tags(try_read_json(vars.download_metadata_json), xml_fields_cache)
     tags.init_aliases(initial_filter_aliases)
 
     builder = DatabaseBuilder(tags)
-    for file in all_files:
-        builder.add_file(file)
-    for file in all_files:
-        builder.add_parent_folders(file)
+    db_files = [file for file in all_files if builder.accepts_file(file)]
+
+    previous_db = None
+    known_descriptions: Dict[str, Dict[str, Any]] = {}
+    if options.incremental:
+        with tracer.span('previous db'):
+            previous_db = fetch_previous_db(vars, download_cache)
+            if previous_db is not None:
+                uncached_files = [str(file) for file in db_files if not hash_cache.has(str(file), finder.stats.get(str(file)))]
+                known_descriptions = unchanged_descriptions(previous_db, vars, download_cache, uncached_files)
+    with tracer.span('hashing') as span:
+        descriptions = describe_files(db_files, hash_cache, options.jobs, known_descriptions, finder.stats)
+        hash_cache.save()
+        span.count(files=len(db_files), bytes=sum(description['size'] for description in descriptions))
+    hash_cache.print_stats()
+
+    with tracer.span('tags') as span:
+        files_terms = tags.extract_files_terms(db_files, [description['hash'] for description in descriptions], options.jobs)
+        for file, description, file_terms in zip(db_files, descriptions, files_terms):
+            builder.add_file(file, description, file_terms)
+        xml_fields_cache.save()
+        span.count(files=len(db_files))
+    xml_fields_cache.print_stats()
+
+    with tracer.span('add_parent_folders') as span:
+        for file in all_files:
+            builder.add_parent_folders(file)
+        span.count(files=len(all_files))
 
     db = builder.build(db_id=vars.db_id)
 
-    transformer = DatabaseTransformer(db, vars)
-    transformer.apply_urls()
-    transformer.apply_linux_update()
-    transformer.apply_zips()
-
-    persistence = DatabasePersistence(db, vars)
-    if persistence.needs_save():
+    with tracer.span('transform'):
+        transformer = DatabaseTransformer(db, vars, download_cache)
+        with tracer.span('apply_urls'):
+            transformer.apply_urls()
+        with tracer.span('apply_linux_update'):
+            transformer.apply_linux_update()
+        with tracer.span('apply_zips'):
+            transformer.apply_zips()
+
+    persistence = DatabasePersistence(db, vars, options, download_cache, previous_db)
+    with tracer.span('needs_save'):
+        needs_save = persistence.needs_save()
+    download_cache.print_stats()
+    if needs_save:
         print()
         print('Changes detected. Proceeding to save new db...')
-        persistence.save()
-        save_report_terms_in_readme(tags.get_report_terms())
+        with tracer.span('save'):
+            persistence.save()
+            save_report_terms_in_readme(tags.get_report_terms())
         print()
         print('Saving complete.')
     else:
         print()
         print('No changes detected.')
 
-def compare_databases(left_path: str, right_path: str) -> None:
-    are_same = mut_diff_db(get_url_db(left_path), get_url_db(right_path))
+def manage_xml_cache(action: str, max_age_days: int) -> None:
+    xml_fields_cache = XmlFieldsCache(str(Path(BuildVars().cache_dir, XmlFieldsCache.file_name)))
+    xml_fields_cache.load()
+    if action == 'list':
+        xml_fields_cache.print_entries()
+    elif action == 'prune':
+        pruned = xml_fields_cache.prune(max_age_days)
+        xml_fields_cache.save()
+        print(f'Pruned {pruned} entries from the XML cache.')
+    else:
+        raise ValueError(action)
+
+def compare_databases(left_path: str, right_path: str, download_cache: bool, format: str, output: Optional[str]) -> None:
+    cache = DownloadCache(str(Path(BuildVars().cache_dir, DownloadCache.dir_name)) if download_cache else None)
+    left_db, right_db = get_url_db(left_path, summaries=False, cache=cache), get_url_db(right_path, summaries=False, cache=cache)
+    # Summaries with the same hash on both sides are equal, so neither of them needs to be downloaded.
+    same_summaries = same_summary_zip_ids(left_db, right_db)
+    load_zip_summaries(left_db, [zip_id for zip_id in left_db.get('zips', {}) if zip_id not in same_summaries], cache)
+    load_zip_summaries(right_db, [zip_id for zip_id in right_db.get('zips', {}) if zip_id not in same_summaries], cache)
+    cache.print_stats()
+
+    left_digest, right_digest = DbDigest(left_db), DbDigest(right_db)
+    are_same = left_digest.root.digest == right_digest.root.digest
+    db_diff = diff_databases(left_db, right_db, left_digest, right_digest)
+    db_diff_text = json.dumps(db_diff, indent=4, sort_keys=True) if format == 'json' else db_diff_as_text(db_diff)
+    if output is None:
+        print(db_diff_text)
+    else:
+        with open(output, 'w') as f:
+            f.write(db_diff_text + '\n')
+        print(f'Differences written to {output}')
+
     print()
     if are_same:
         print('No changes.')
@@ -106,11 +223,24 @@ class BuildVars:
     linux_github_repository: str = os.getenv('LINUX_GITHUB_REPOSITORY', '').strip()
     zips_config: str = os.getenv('ZIPS_CONFIG', '').strip()
     download_metadata_json: str = os.getenv('DOWNLOAD_METADATA_JSON', '/tmp/download_metadata.json').strip()
+    cache_dir: str = os.getenv('CACHE_DIR', default_cache_dir()).strip()
+    zips_branch: str = os.getenv('ZIPS_BRANCH', 'zips').strip()
+
+@dataclass
+class BuildOptions:
+    hash_cache: bool = True
+    xml_cache: bool = True
+    download_cache: bool = True
+    jobs: int = 1
+    incremental: bool = False
+    show_diff: bool = False
 
 class Finder:
     def __init__(self, dir: str):
         self._dir = dir
-        self._not_in_directory: List[str] = []
+        self._not_in_directory: Set[str] = set()
+        # Stats taken while walking, so files don't need to be stat-ed again for hashing and caching.
+        self.stats: Dict[str, os.stat_result] = {}
 
     @property
     def dir(self) -> str:
@@ -119,18 +249,31 @@ class Finder:
     def ignore_folder(self, folder: str) -> None:
         directory = str(Path(folder))
         print('Ignored folder: %s' % directory)
-        self._not_in_directory.append(directory)
+        self._not_in_directory.add(directory)
 
     def find_all(self) -> List[Path]:
-        return sorted(self._scan(self._dir), key=lambda file: str(file).lower())
+        # Paths are composed as the same strings that Path(entry.path) would produce, with their lowercase sort keys next to them.
+        root = str(Path(self._dir))
+        files: List[Tuple[str, str]] = []
+        pending = [(self._dir, '' if root == '.' else root + '/')]
+        while len(pending) > 0:
+            directory, prefix = pending.pop()
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    path = prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if path not in self._not_in_directory:
+                            pending.append((entry.path, path + '/'))
+                        continue
 
-    def _scan(self, directory: str) -> Generator[Path, None, None]:
-        for entry in os.scandir(directory):
-            if entry.is_dir(follow_symlinks=False):
-                if str(Path(entry.path)) not in self._not_in_directory:
-                    yield from self._scan(entry.path)
-            else:
-                yield Path(entry.path)
+                    files.append((path.lower(), path))
+                    try:
+                        self.stats[path] = entry.stat()
+                    except OSError:
+                        pass
+
+        files.sort()
+        return [Path(path) for _, path in files]
 
 initial_filter_aliases = [
     # Consoles
@@ -154,17 +297,29 @@ initial_filter_aliases = [
     ['service-cores', 'utility'],
 ]
 
+class TermCharacters(dict):
+    # str.translate table that keeps [-_a-z0-9.] and deletes every other character.
+    def __init__(self) -> None:
+        super().__init__({ord(c): ord(c) for c in '-_abcdefghijklmnopqrstuvwxyz0123456789.'})
+
+    def __missing__(self, key: int) -> None:
+        return None
+
 class Tags:
-    filter_part_regex = re.compile("[-_a-z0-9.]$", )
+    term_characters = TermCharacters()
 
-    def __init__(self, metadata_props: Optional[Dict[str, Any]]) -> None:
+    def __init__(self, metadata_props: Optional[Dict[str, Any]], xml_fields_cache: Optional['XmlFieldsCache'] = None) -> None:
         self._metadata = Metadata(metadata_props if metadata_props is not None else Metadata.new_props())
+        self._xml_fields = xml_fields_cache if xml_fields_cache is not None else XmlFieldsCache(None)
         self._dict: Dict[str, int] = {}
         self._alternatives: Dict[str, Set[str]] = {}
         self._index: int = 0
         self._report_set: Set[str] = set()
         self._used: Set[int] = set()
         self._init: bool = False
+        self._clean_terms: Dict[str, str] = {}
+        self._term_indexes: Dict[str, int] = {}
+        self._directory_terms: Dict[Tuple[str, ...], Tuple[str, List[str], List[str]]] = {}
 
     def init_aliases(self, aliases: List[List[str]]) -> None:
         if self._init:
@@ -195,108 +350,162 @@ class Tags:
         self._index += 1
         return result
     
-    def get_tags_for_file(self, path: Path) -> List[int]:
-        return sorted(self._impl_tags_for_file(path))
+    def get_tags_for_file(self, path: Path, file_hash: Optional[str] = None) -> List[int]:
+        return self.assign_file_tags(self.extract_file_terms(path, file_hash))
 
-    def _impl_tags_for_file(self, path: Path) -> List[int]:
-        parent = path.parts[0].lower()
-        if parent[0] == '|':
-            parent = parent[1:]
-        if parent[0] == '_':
-            parent = parent[1:]
+    def extract_files_terms(self, paths: List[Path], file_hashes: List[Optional[str]], jobs: int) -> List['FileTerms']:
+        results = parallel_map(lambda args: self._try_extract_file_terms(*args), list(zip(paths, file_hashes)), jobs)
 
-        result: List[int] = []
-        if len(path.parts) > 1:
-            self._append(result, self._use_term(parent))
+        errors = [error for _, error in results if error is not None]
+        if len(errors) > 0:
+            print(f'ERROR: {len(errors)} files with defect XML.')
+            raise errors[0]
 
-        self._add_cores_terms(parent, result)
+        return [file_terms for file_terms, _ in results if file_terms is not None]
+
+    def _try_extract_file_terms(self, path: Path, file_hash: Optional[str]) -> Tuple[Optional['FileTerms'], Optional[ET.ParseError]]:
+        try:
+            return self.extract_file_terms(path, file_hash), None
+        except ET.ParseError as e:
+            return None, e
+
+    # Phase one: no index is handed out here, so it can run concurrently for many files.
+    def extract_file_terms(self, path: Path, file_hash: Optional[str]) -> 'FileTerms':
+        parent, head_terms, location_terms = self._file_directory_terms(path.parts)
+
+        terms: List[str] = [*head_terms]
+        alternative: Optional[Tuple[str, str]] = None
 
         suffix = path.suffix.lower()
         stem = path.stem.lower()
 
         if suffix == '.mra':
-            self._append(result, self._use_term('mra'))
-            rbf, zips = read_mra_fields(path)
+            terms.append('mra')
+            rbf, zips = self._xml_fields.mra_fields(path, file_hash, read_mra_fields)
 
             if rbf is not None:
-                self._append(result, self._use_arcade_term(rbf))
+                terms.append('arcade-' + rbf)
             
             if self._contains_hbmame_rom(zips):
-                self._append(result, self._use_term('hbmame'))
+                terms.append('hbmame')
 
             if len(path.parts) > 1 and path.parts[1].lower() == '_alternatives':
-                self._append(result, self._use_term('alternatives'))
+                terms.append('alternatives')
 
                 if rbf is not None and len(path.parts) > 2:
-                    alternative_subfolder = path.parts[2].lower()[1:]
-                    if alternative_subfolder not in self._alternatives:
-                        self._alternatives[alternative_subfolder] = set()
-                    self._alternatives[alternative_subfolder].add(rbf)
+                    alternative = (path.parts[2].lower()[1:], rbf)
 
         elif suffix == '.rbf':
             nodates = stem[0:-9]
             if not nodates:
                 nodates = stem
 
-            self._append(result, self._use_term('cores'))
+            terms.append('cores')
             if parent == 'arcade' or nodates.startswith('arcade-'):
-                self._append(result, self._use_arcade_term(nodates))
+                terms.append('arcade-' + nodates)
             else:
-                self._append(result, self._use_term(nodates))
+                terms.append(nodates)
 
             if nodates in ['gba2p', 'gameboy2p']:
-                self._append(result, self._use_term('handheld2p'))
+                terms.append('handheld2p')
 
         elif suffix == '.mgl':
-            self._append(result, self._use_term('mgl'))
-            self._append(result, self._use_term('cores'))
-            self._append(result, self._use_term(stem))
-            rbf, _ = read_mgl_fields(path)
+            terms.append('mgl')
+            terms.append('cores')
+            terms.append(stem)
+            rbf, _ = self._xml_fields.mgl_fields(path, file_hash, read_mgl_fields)
             if rbf is not None:
-                self._append(result, self._use_term(Path(rbf).name.lower()))
+                terms.append(Path(rbf).name.lower())
 
         if stem in ['menu', 'mister']:
-            self._append(result, self._use_term('essential'))
+            terms.append('essential')
+
+        terms.extend(location_terms)
 
+        if parent == 'games':
+            second_level = path.parts[2].lower()
+            if second_level.endswith('.rom'):
+                terms.append('bios')
+            elif second_level not in ['palettes'] and suffix != '.rbf' and suffix != '.mra':
+                terms.append('extra-utilities')
+        elif parent == 'docs' and 'readme' in stem:
+            terms.append('readme')
+
+        return FileTerms(terms, alternative)
+
+    def _file_directory_terms(self, parts: Tuple[str, ...]) -> Tuple[str, List[str], List[str]]:
+        # Files in the same folder share everything except the terms derived from their own name.
+        # Files at the root, or right below games, docs or Cheats, use their own name for these terms too.
+        directory = parts[0:-1]
+        cacheable = len(directory) >= 2 or (len(directory) == 1 and self._clean_parent(parts[0]) not in ['games', 'docs', 'cheats'])
+        if cacheable and directory in self._directory_terms:
+            return self._directory_terms[directory]
+
+        parent = self._clean_parent(parts[0])
+
+        head_terms: List[str] = []
+        if len(parts) > 1:
+            head_terms.append(parent)
+        head_terms.extend(self._cores_terms(parent))
+
+        location_terms: List[str] = []
         if parent in ['games', 'docs']:
-            first_level = path.parts[1].lower()
-            self._append(result, self._use_term(first_level))
+            first_level = parts[1].lower()
+            location_terms.append(first_level)
             if self._metadata.is_mgl_home(first_level):
-                self._append(result, self._use_term('mgl'))
-                self._append(result, self._use_term(self._metadata.mgl_dependency(first_level)))
+                location_terms.append('mgl')
+                location_terms.append(self._metadata.mgl_dependency(first_level))
 
             category = self._metadata.category_by_home(first_level)
             if category is not None:
-                self._append(result, self._use_term(category))
+                location_terms.append(category)
     
             if first_level in ['gba2p', 'gameboy2p']:
-                self._append(result, self._use_term('handheld2p'))
+                location_terms.append('handheld2p')
 
-            second_level = path.parts[2].lower()
-            if len(path.parts) > 3:
-                self._append(result, self._use_term(second_level))
-            
-            if parent == 'games':
-                if second_level.endswith('.rom'):
-                    self._append(result, self._use_term('bios'))
-                elif second_level not in ['palettes'] and suffix != '.rbf' and suffix != '.mra':
-                    self._append(result, self._use_term('extra-utilities'))
-            elif parent == 'docs' and 'readme' in stem:
-                self._append(result, self._use_term('readme'))
+            second_level = parts[2].lower()
+            if len(parts) > 3:
+                location_terms.append(second_level)
 
         elif parent == 'cheats':
-            first_level = path.parts[1].lower()
-            self._append(result, self._use_term(first_level))
-            self._append(result, self._use_term('console'))
+            first_level = parts[1].lower()
+            location_terms.append(first_level)
+            location_terms.append('console')
 
         elif parent in ['gamma', 'filters', 'filters_audio', 'shadow_masks']:
-            self._append(result, self._use_term('all_filters'))
+            location_terms.append('all_filters')
         
             if parent in ['gamma', 'filters', 'shadow_masks']:
-                self._append(result, self._use_term('filters_video'))
+                location_terms.append('filters_video')
 
+        result = (parent, head_terms, location_terms)
+        if cacheable:
+            self._directory_terms[directory] = result
         return result
 
+    @staticmethod
+    def _clean_parent(part: str) -> str:
+        parent = part.lower()
+        if parent[0] == '|':
+            parent = parent[1:]
+        if parent[0] == '_':
+            parent = parent[1:]
+        return parent
+
+    # Phase two: indexes are handed out in first-seen order, so files must come in the same order every build.
+    def assign_file_tags(self, file_terms: 'FileTerms') -> List[int]:
+        result: List[int] = []
+        for term in file_terms.terms:
+            self._append(result, self._use_term(term))
+
+        if file_terms.alternative is not None:
+            alternative_subfolder, rbf = file_terms.alternative
+            if alternative_subfolder not in self._alternatives:
+                self._alternatives[alternative_subfolder] = set()
+            self._alternatives[alternative_subfolder].add(rbf)
+
+        return sorted(result)
+
     def _contains_hbmame_rom(self, zips: List[str]) -> bool:
         for z in zips:
             if 'hbmame' in z.lower():
@@ -367,21 +576,27 @@ class Tags:
         return result
 
     def _use_term(self, term: str) -> int:
-        return self._use_from_dict(self._clean_term(term))
+        index = self._term_indexes.get(term)
+        if index is None:
+            index = self._use_from_dict(self._clean_term(term))
+            self._term_indexes[term] = index
+        return index
 
     def _use_arcade_term(self, term: str) -> int:
         return self._use_from_dict(self._clean_term('arcade-' + term))
 
-    def _use_cores_term(self, term: str) -> int:
-        return self._use_from_dict(self._clean_term(term + '-cores'))
-
     def _clean_term(self, term: str) -> str:
         if not term:
             raise Exception('Term is empty')
-        result = ''.join(filter(lambda chr: self.filter_part_regex.match(chr), term.replace(' ', '')))
-        if result not in self._report_set:
-            self._report_set.add(result)
-        return result.replace('-', '').replace('_', '')
+        clean_term = self._clean_terms.get(term)
+        if clean_term is not None:
+            return clean_term
+
+        result = term.translate(self.term_characters)
+        self._report_set.add(result)
+        clean_term = result.replace('-', '').replace('_', '')
+        self._clean_terms[term] = clean_term
+        return clean_term
 
     def _use_from_dict(self, term: str) -> int:
         if term == 'menu.rbf':
@@ -397,10 +612,15 @@ class Tags:
         return self._dict[term]
 
     def _add_cores_terms(self, parent: str, result: List[int]) -> None:
+        for term in self._cores_terms(parent):
+            self._append(result, self._use_term(term))
+
+    def _cores_terms(self, parent: str) -> List[str]:
         if parent in ['console', 'computer', 'other', 'arcade']:
-            self._append(result, self._use_cores_term(parent))
+            return [parent + '-cores']
         elif parent == 'utility':
-            self._append(result, self._use_cores_term('service'))
+            return ['service-cores']
+        return []
 
     def _append(self, result: List[int], term: int) -> None:
         if term in result:
@@ -421,6 +641,11 @@ class Tags:
                 result.append(entry)
         return sorted(result)
 
+@dataclass
+class FileTerms:
+    terms: List[str]
+    alternative: Optional[Tuple[str, str]] = None
+
 class DatabaseBuilder:
     main_binaries = ['MiSTer', 'menu.rbf']
 
@@ -429,16 +654,18 @@ class DatabaseBuilder:
         self._folders: Dict[str, Any] = {}
         self._tags = tags
 
-    def add_file(self, file: Path) -> None:
-        strfile = str(file)
+    def accepts_file(self, file: Path) -> bool:
+        return file.name not in ['.delme', '.DS_Store'] and str(file) not in ['README.md', 'LICENSE', 'latest_linux.txt', '.gitattributes']
 
-        if file.name in ['.delme', '.DS_Store'] or strfile in ['README.md', 'LICENSE', 'latest_linux.txt', '.gitattributes']:
+    def add_file(self, file: Path, description: Dict[str, Any], file_terms: FileTerms) -> None:
+        if not self.accepts_file(file):
             return
-        
+
+        strfile = str(file)
         if strfile.startswith('games') or strfile.startswith('docs'):
             strfile = f'|{strfile}'
 
-        self._files[strfile] = {**new_file_description(str(file)), "tags": self._tags.get_tags_for_file(file)}
+        self._files[strfile] = {**description, "tags": self._tags.assign_file_tags(file_terms)}
 
         if file.name.lower() in ['boot.rom', 'boot1.rom', 'boot0.rom'] and not strfile.startswith('|games/AO486/'):
             self._files[strfile]['overwrite'] = False
@@ -455,8 +682,11 @@ class DatabaseBuilder:
 
             if strfolder.startswith('games') or strfolder.startswith('docs'):
                 strfolder = f'|{strfolder}'
-            if strfolder in self._folders or strfolder in ['.', '']:
+            if strfolder in ['.', '']:
                 continue
+            if strfolder in self._folders:
+                # Its parents were added together with it.
+                break
             self._folders[strfolder] = {"tags": self._tags.get_tags_for_folder(folder)}
 
     def build(self, db_id: str) -> Dict[str, Any]:
@@ -469,9 +699,10 @@ class DatabaseBuilder:
         }
 
 class DatabaseTransformer:
-    def __init__(self, db: Dict[str, Any], vars: BuildVars):
+    def __init__(self, db: Dict[str, Any], vars: BuildVars, download_cache: 'DownloadCache'):
         self._db = db
         self._vars = vars
+        self._download_cache = download_cache
     
     def apply_urls(self) -> None:
         if self._vars.base_files_url == '':
@@ -493,10 +724,8 @@ class DatabaseTransformer:
         
         print('LINUX_GITHUB_REPOSITORY:', self._vars.linux_github_repository)
         url_linux = get_linux_latest_release_url(self._vars.linux_github_repository, self._vars.github_token)
-        with tempfile.NamedTemporaryFile() as tmp_file:
-            download_file(url_linux, tmp_file.name)
-            version = Path(url_linux).stem[-6:]
-            self._db['linux'] = {**new_file_description(tmp_file.name), "url": url_linux, "version": version}
+        version = Path(url_linux).stem[-6:]
+        self._db['linux'] = {**self._download_cache.file_description(url_linux), "url": url_linux, "version": version}
 
     def apply_zips(self) -> None:
         if self._vars.zips_config == '':
@@ -513,24 +742,32 @@ class DatabaseTransformer:
         self._db['zips'] = builder.build()
 
 class DatabasePersistence:
-    def __init__(self, db: Dict[str, Any], vars: BuildVars):
+    def __init__(self, db: Dict[str, Any], vars: BuildVars, options: BuildOptions, download_cache: 'DownloadCache', previous_db: Optional[Dict[str, Any]] = None):
         self._db = db
         self._vars = vars
+        self._options = options
+        self._download_cache = download_cache
+        self._previous_db = previous_db
+        self._previous_zips: Dict[str, Any] = {}
 
     def needs_save(self) -> bool:
-        if self._vars.db_url == '':
-            print('Missing "DB_URL", can not check previous db!')
+        previous_db = self._previous_db if self._previous_db is not None else fetch_previous_db(self._vars, self._download_cache)
+        if previous_db is None:
             return True
 
-        try:
-            previous_db = get_url_db(self._vars.db_url)
-        except ReturnCodeException as e:
-            print('ReturnCodeException at get_url_db ' + self._vars.db_url)
-            print(e)
-            return True
+        with tracer.span('resolve_previous_summaries'):
+            resolve_previous_summaries(previous_db, self._db, self._download_cache)
+            self._previous_zips = reusable_zip_artifacts(previous_db)
+
+        with tracer.span('digest'):
+            previous_digest, digest = DbDigest(previous_db), DbDigest(self._db)
+        if previous_digest.root.digest == digest.root.digest:
+            return False
 
-        are_same = mut_diff_db(previous_db, json.loads(json.dumps(self._db)))
-        return not are_same
+        if self._options.show_diff:
+            with tracer.span('show_diff'):
+                print(db_diff_as_text(diff_databases(previous_db, self._db, previous_digest, digest)))
+        return True
 
     def save(self):
         easy_debug = self._vars.db_json_name == 'dbresult.json'
@@ -538,16 +775,111 @@ class DatabasePersistence:
             if self._vars.base_files_url == '':
                 raise ValueError('Variable "BASE_FILES_URL" missing!')
 
-            save_zips(self._db['zips'], self._vars.base_files_url)
+            store = ArtifactStore(self._vars.zips_branch)
+            with tracer.span('save_zips') as span:
+                save_zips(self._db['zips'], self._vars.base_files_url, self._options.jobs, self._previous_zips, store)
+                span.count(files=len(self._db['zips']))
+            with tracer.span('commit_zips'):
+                zips_sha = store.commit()
+            if zips_sha is not None:
+                print(f'New zips committed to branch "{self._vars.zips_branch}" as {zips_sha}')
+                set_zips_branch_base_url(self._db['zips'], zips_sha)
+            elif self._vars.zips_branch == '':
+                print('WARNING! No zips branch, new zips were written to the working tree and their urls keep the <ZIPS_BRANCH_BASE_URL> placeholder.')
+
+        with tracer.span('save_json_and_zip'):
+            save_json_and_zip(self._db, self._vars.db_json_name, indent=4 if easy_debug else None)
+
+class ArtifactStore:
+    # Artifacts are written from memory and described from the same bytes, so they are never read back.
+    # With a branch, they are only stored as git blobs to commit them there, so the working tree stays clean
+    # and later builds don't pick them up as db files. Without a branch, they are written to the working tree.
+    def __init__(self, branch: str):
+        self._branch = branch
+        self._blobs: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def save(self, name: str, data: bytes) -> Dict[str, Any]:
+        if self._branch == '':
+            with open(name, 'wb') as f:
+                f.write(data)
+        else:
+            blob = run_input_stdout('git hash-object -w --stdin', data)
+            with self._lock:
+                self._blobs[name] = blob
+
+        return {'size': len(data), 'hash': hashlib.md5(data).hexdigest()}
+
+    def commit(self) -> Optional[str]:
+        if self._branch == '' or len(self._blobs) == 0:
+            return None
 
-        with open(self._vars.db_json_name, 'w') as f:
-            json.dump(self._db, f, indent=4 if easy_debug else None, sort_keys=True)
+        tree = run_input_stdout('git mktree', ''.join(f'100644 blob {blob}\t{name}\n' for name, blob in sorted(self._blobs.items())).encode())
+
+        # Reused zips point to older commits of the branch, so they must stay reachable from the new one.
+        parent = ''
+        try:
+            run(f'git fetch --quiet --depth=1 origin {self._branch}')
+            parent = '-p ' + run_stdout('git rev-parse --verify FETCH_HEAD')
+        except ReturnCodeException:
+            print(f'Branch "{self._branch}" not found in origin, starting it from scratch.')
+
+        sha = run_stdout(f'git commit-tree {tree} {parent} -m -')
+        run(f'git update-ref refs/heads/{self._branch} {sha}')
+        return sha
+
+class PathIndex:
+    # Sorted view over the keys of a db section, answering prefix queries with bisect.
+    # Prefixes are plain string prefixes, same as str.startswith.
+    def __init__(self, entries: Dict[str, Any]):
+        self._keys = sorted(entries)
+        self._ordinals = {key: ordinal for ordinal, key in enumerate(entries)}
+
+    def remove_under(self, prefix: str) -> List[str]:
+        lo, hi = self._range(prefix)
+        removed = self._keys[lo:hi]
+        del self._keys[lo:hi]
+        # Keeps the order in which the entries were originally inserted in the db.
+        removed.sort(key=lambda key: self._ordinals[key])
+        return removed
+
+    def count_under(self, prefix: str, limit: int) -> int:
+        lo, hi = self._range(prefix)
+        return min(hi - lo, limit)
+
+    def children(self, prefix: str, depth: int) -> Set[str]:
+        result: Set[str] = set()
+        lo, hi = self._range(prefix)
+        while lo < hi:
+            parts = Path(self._keys[lo]).parts
+            if len(parts) <= depth:
+                lo += 1
+                continue
+
+            result.add(parts[depth])
+            if len(parts) == depth + 1:
+                lo += 1
+                continue
+
+            # Skips the rest of the entries inside this child, which are exactly the ones prefixed with 'child/'.
+            # Siblings like 'child-2' sort before them, so they were visited already.
+            lo = self._range(str(Path(*parts[0:depth + 1])) + '/')[1]
+        return result
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        if prefix == '':
+            return 0, len(self._keys)
+
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix[0:-1] + chr(ord(prefix[-1]) + 1), lo)
+        return lo, hi
 
 class ZipsBuilder:
     def __init__(self, db: Dict[str, Any]):
         self._db = db
         self._zips: Dict[str, Any] = {}
         self._intermediate: Dict[str, Any] = {}
+        self._indexes = {key: PathIndex(db[key]) for key in ['files', 'folders']}
 
     def add_zip(self, zip_id: str, zip_description: Dict[str, Any]) -> None:
         mode = zip_description.get('mode', 'simple')
@@ -635,21 +967,13 @@ class ZipsBuilder:
             self._simple_process(composed_zip_id, composed_source, {**zip_description, 'source': composed_source})
 
     def _move_elements(self, zip_id: str, source: str, key: str) -> None:
-        for element in list(self._db[key]):
-            if element.startswith(source):
-                self._intermediate[zip_id][key][element] = self._db[key][element]
-                self._intermediate[zip_id][key][element]['zip_id'] = zip_id
-                del self._db[key][element]
+        for element in self._indexes[key].remove_under(source):
+            self._intermediate[zip_id][key][element] = self._db[key][element]
+            self._intermediate[zip_id][key][element]['zip_id'] = zip_id
+            del self._db[key][element]
 
     def _fill_subfolders(self, subfolders: Set[str], subfolder_len: int, source: str, key: str) -> None:
-        for element in list(self._db[key]):
-            if element.startswith(source):
-                parts = Path(element).parts
-                if len(parts) == subfolder_len:
-                    continue
-
-                subfolder = Path(element).parts[subfolder_len]
-                subfolders.add(subfolder)
+        subfolders.update(self._indexes[key].children(source, subfolder_len))
 
     def _add_zip(self, zip_id: str, contents: List[str], description: str, parent: str, mode: Optional[str] = None, source: Optional[str] = None) -> None:
         path = parent
@@ -683,15 +1007,95 @@ class ZipsBuilder:
         self._zips[zip_id] = result
 
     def _enough_files_for_subfolder(self, composed_source: str) -> bool:
-        qty = 0
-        for f in self._db['files']:
-            if not f.startswith(composed_source):
-                continue
-            qty += 1
-            if qty >= 60:
-                return True
+        return self._indexes['files'].count_under(composed_source, 60) >= 60
+
+class HashCache:
+    version = 1
+
+    def __init__(self, path: Optional[str]):
+        self._path = path
+        self._root = os.path.abspath('.')
+        self._entries: Dict[str, List[Any]] = {}
+        self._seen: Dict[str, List[Any]] = {}
+        self._started_ns = time.time_ns()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        if self._path is None:
+            return
 
-        return False
+        try:
+            content = load_json(self._path)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            print(f'WARNING! Hash cache "{self._path}" is not valid JSON, ignoring it.')
+            return
+
+        if content.get('version') != self.version or content.get('root') != self._root:
+            print(f'Hash cache "{self._path}" belongs to another version or source directory, ignoring it.')
+            return
+
+        self._entries = content['entries']
+
+    def file_description(self, file: str, stat: Optional[os.stat_result] = None) -> Dict[str, Any]:
+        if stat is None:
+            stat = os.stat(file)
+        if self._path is None:
+            return {"size": stat.st_size, "hash": file_hash(file, stat.st_size)}
+
+        key = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        entry = self._entries.get(file)
+        if entry is not None and entry[0:3] == key:
+            hash = entry[3]
+            with self._lock:
+                self.hits += 1
+        else:
+            hash = file_hash(file, stat.st_size)
+            with self._lock:
+                self.misses += 1
+
+        # Files touched after the build started might change again within the same mtime tick, so they are not trusted.
+        if stat.st_mtime_ns < self._started_ns:
+            self._seen[file] = [*key, hash]
+
+        return {"size": stat.st_size, "hash": hash}
+
+    def has(self, file: str, stat: Optional[os.stat_result] = None) -> bool:
+        if self._path is None:
+            return False
+
+        if stat is None:
+            stat = os.stat(file)
+        entry = self._entries.get(file)
+        return entry is not None and entry[0:3] == [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def keep(self, file: str, description: Dict[str, Any], stat: Optional[os.stat_result] = None) -> None:
+        # Descriptions obtained without hashing, like the ones reused from the previous db, stay cached for the next build.
+        if self._path is None:
+            return
+
+        if stat is None:
+            stat = os.stat(file)
+        if stat.st_size == description['size'] and stat.st_mtime_ns < self._started_ns:
+            self._seen[file] = [stat.st_size, stat.st_mtime_ns, stat.st_ino, description['hash']]
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+
+        Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=str(Path(self._path).parent), delete=False) as f:
+            json.dump({'version': self.version, 'root': self._root, 'entries': self._seen}, f)
+        os.replace(f.name, self._path)
+
+    def print_stats(self) -> None:
+        if self._path is None:
+            print('Hash cache: disabled')
+        else:
+            print(f'Hash cache: {self.hits} hits, {self.misses} misses')
 
 class Metadata:
     @staticmethod
@@ -716,37 +1120,343 @@ class Metadata:
     def aliases(self) -> List[List[str]]:
         return self._props['aliases']
 
+class DownloadCache:
+    # Decoded dbs and summaries from previous downloads, so that reloading them skips the network and the unzipping.
+    # Entries are plain JSON, so even a tampered file can't run code when loaded.
+    version = 2
+    dir_name = 'downloads'
+
+    def __init__(self, directory: Optional[str]):
+        self._directory = directory
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def db(self, url: str) -> Dict[str, Any]:
+        if self._directory is None:
+            return download_db(url)
+
+        entry = self._load(url)
+        response = http_transport.get(url, validators=entry['validators'] if entry is not None else None)
+        if entry is not None and response.not_modified:
+            return self._hit(entry)
+
+        # Servers without validators (or file:// urls) still save the decoding when the content is the same.
+        content_hash = hashlib.md5(response.body).hexdigest()
+        if entry is not None and entry['content_hash'] == content_hash:
+            self._store(url, {**entry, 'validators': response.validators})
+            return self._hit(entry)
+
+        content = decode_db(response.body)
+        self._store(url, {'validators': response.validators, 'content_hash': content_hash, 'content': content})
+        self._count(hit=False)
+        return content
+
+    def summary(self, url: str, hash: str) -> Dict[str, Any]:
+        if self._directory is None:
+            return get_summary_file_content(url)
+
+        # A published summary never changes, so its url and hash identify it.
+        key = f'{url}#{hash}'
+        entry = self._load(key)
+        if entry is not None:
+            return self._hit(entry)
+
+        content = get_summary_file_content(url)
+        self._store(key, {'content': content})
+        self._count(hit=False)
+        return content
+
+    def file_description(self, url: str) -> Dict[str, Any]:
+        if self._directory is None:
+            return download_file_description(url)
+
+        # Only meant for immutable urls, like raw files pinned to a tree sha.
+        key = f'{url}#description'
+        entry = self._load(key)
+        if entry is not None:
+            return self._hit(entry)
+
+        content = download_file_description(url)
+        self._store(key, {'content': content})
+        self._count(hit=False)
+        return content
+
+    def print_stats(self) -> None:
+        if self._directory is None:
+            print('Download cache: disabled')
+        else:
+            print(f'Download cache: {self.hits} hits, {self.misses} misses')
+
+    def _hit(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        self._count(hit=True)
+        return entry['content']
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _path(self, key: str) -> Path:
+        return Path(str(self._directory), hashlib.md5(key.encode()).hexdigest() + '.json')
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            entry = load_json(str(self._path(key)))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f'WARNING! Download cache entry for "{key}" is not readable, ignoring it: {e}')
+            return None
+
+        if not isinstance(entry, dict) or entry.get('version') != self.version or entry.get('key') != key:
+            return None
+        return entry
+
+    def _store(self, key: str, entry: Dict[str, Any]) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=str(path.parent), delete=False) as f:
+            json.dump({**entry, 'version': self.version, 'key': key}, f)
+        os.replace(f.name, path)
+
+def describe_files(files: List[Path], hash_cache: HashCache, jobs: int, known_descriptions: Dict[str, Dict[str, Any]], stats: Dict[str, os.stat_result]) -> List[Dict[str, Any]]:
+    pending = [str(file) for file in files if str(file) not in known_descriptions]
+    if len(known_descriptions) > 0:
+        print(f'Reusing {len(files) - len(pending)} descriptions from the previous db, hashing {len(pending)} files.')
+
+    hashed = parallel_map(lambda file: hash_cache.file_description(file, stats.get(file)), pending, jobs)
+    described = dict(zip(pending, hashed))
+    for file in files:
+        if str(file) in known_descriptions:
+            hash_cache.keep(str(file), known_descriptions[str(file)], stats.get(str(file)))
+    return [known_descriptions[str(file)] if str(file) in known_descriptions else described[str(file)] for file in files]
+
+def parallel_map(fn: Any, items: List[Any], jobs: int, chunksize: int = 16) -> List[Any]:
+    # Results come back in the same order as 'items', so the outcome is identical to a serial run.
+    if jobs == 1:
+        return [fn(item) for item in items]
+
+    with ThreadPool(processes=jobs) as pool:
+        return pool.map(fn, items, chunksize=chunksize)
+
+def fetch_previous_db(vars: BuildVars, cache: 'DownloadCache') -> Optional[Dict[str, Any]]:
+    if vars.db_url == '':
+        print('Missing "DB_URL", can not check previous db!')
+        return None
+
+    try:
+        return get_url_db(vars.db_url, summaries=False, cache=cache)
+    except (ReturnCodeException, HttpException, BadZipFile, ValueError) as e:
+        print(f'{type(e).__name__} at get_url_db ' + vars.db_url)
+        print(e)
+        return None
+
+def unchanged_descriptions(previous_db: Dict[str, Any], vars: BuildVars, cache: 'DownloadCache', uncached_files: List[str]) -> Dict[str, Dict[str, Any]]:
+    sha = base_files_url_sha(vars.base_files_url, previous_db.get('base_files_url', ''))
+    if sha is None:
+        print('Could not find the commit of the previous db, doing a full build.')
+        return {}
+
+    changed = git_changed_paths(sha)
+    if changed is None:
+        print(f'Could not diff against previous commit {sha}, doing a full build.')
+        return {}
+
+    print(f'Previous commit: {sha}, changed paths: {len(changed)}')
+
+    # Only files that would be hashed otherwise need a previous description, so only the summaries of the zips
+    # that may hold them are downloaded. The rest are left for resolve_previous_summaries.
+    zips = previous_db.get('zips', {})
+    unknown_files = [file for file in uncached_files if file not in changed]
+    unknown = PathIndex({file: None for file in unknown_files})
+    zip_ids = [zip_id for zip_id, zip_description in zips.items() if 'source' not in zip_description or unknown.count_under(zip_description['source'].lstrip('|'), 1) > 0]
+    print(f'Previous zip summaries needed by {len(unknown_files)} uncached files: {len(zip_ids)} of {len(zips)}.')
+    load_zip_summaries(previous_db, zip_ids, cache)
+
+    previous_files = [previous_db['files']]
+    for zip_id in zip_ids:
+        if 'summary_file_content' in zips[zip_id]:
+            previous_files.append(zips[zip_id]['summary_file_content']['files'])
+
+    result: Dict[str, Dict[str, Any]] = {}
+    for files in previous_files:
+        for file, description in files.items():
+            if file[0] == '|':
+                file = file[1:]
+            if file in changed:
+                continue
+            result[file] = {"size": description['size'], "hash": description['hash']}
+    return result
+
+def base_files_url_sha(base_files_url: str, previous_base_files_url: str) -> Optional[str]:
+    prefix, _, suffix = base_files_url.partition('%s')
+    if not previous_base_files_url.startswith(prefix) or not previous_base_files_url.endswith(suffix):
+        return None
+
+    sha = previous_base_files_url[len(prefix):len(previous_base_files_url) - len(suffix)]
+    return sha if re.fullmatch('[0-9a-f]{7,40}', sha) else None
+
+def git_changed_paths(sha: str) -> Optional[Set[str]]:
+    try:
+        try:
+            run_stdout(f'git cat-file -e {sha}^{{commit}}')
+        except ReturnCodeException:
+            run(f'git fetch --quiet --depth=1 --filter=blob:none origin {sha}')
+
+        # Diffing against the working tree also catches changes that were not committed yet.
+        diff = run_stdout(f'git diff --name-status --no-renames --relative -z {sha}').split('\0')
+        untracked = run_stdout('git ls-files --others -z').split('\0')
+    except ReturnCodeException as e:
+        print(e)
+        return None
+
+    return {path for path in [*diff[1::2], *untracked] if path != ''}
+
 # MiSTer save functions
 
-def save_zips(zips: Dict[str, Any], base_files_url: str) -> None:
+def save_zips(zips: Dict[str, Any], base_files_url: str, jobs: int, previous_zips: Dict[str, Any], store: ArtifactStore) -> None:
     base_zips_url = base_files_url % '<ZIPS_BRANCH_BASE_URL>'
-    for zip_id, zip_description in zips.items():
+    reused = 0
+
+    def save_zip(zip_id: str) -> Tuple[Dict[str, Any], Dict[str, Any], bool]:
+        zip_description = zips[zip_id]
         summary_file_content = zip_description['summary_file_content']
+
+        previous = previous_zips.get(zip_id)
+        if previous is not None and previous['fingerprint'] == zip_fingerprint(zip_description):
+            return previous['summary_file'], previous['contents_file'], True
+
+        summary_file_zip, summary_file_description = save_summary_file_zip(store, zip_id, summary_file_content)
+        summary_file = {**summary_file_description, 'url': f'{base_zips_url}{summary_file_zip}'}
+        contents_file_zip, contents_file_description = save_contents_file_zip(store, zip_id, summary_file_content, zip_description['path'])
+        contents_file = {**contents_file_description, 'url': f'{base_zips_url}{contents_file_zip}'}
+        return summary_file, contents_file, False
+
+    # Each worker holds a single zip at a time, and compression releases the GIL.
+    zip_ids = list(zips)
+    for zip_id, (summary_file, contents_file, was_reused) in zip(zip_ids, parallel_map(save_zip, zip_ids, jobs, chunksize=1)):
+        zip_description = zips[zip_id]
         del zip_description['summary_file_content']
+        zip_description['summary_file'] = summary_file
+        zip_description['contents_file'] = contents_file
+        if was_reused:
+            reused += 1
+
+    print(f'Reused {reused} unchanged zips from the previous db, created {len(zip_ids) - reused}.')
+
+def zip_fingerprint(zip_description: Dict[str, Any]) -> str:
+    # Both archives are derived from the summary content and the zip path only.
+    content = {'path': zip_description['path'], 'summary_file_content': zip_description['summary_file_content']}
+    return hashlib.md5(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+def reusable_zip_artifacts(previous_db: Dict[str, Any]) -> Dict[str, Any]:
+    result: Dict[str, Any] = {}
+    for zip_id, zip_description in previous_db.get('zips', {}).items():
+        if 'summary_file_content' not in zip_description or 'summary_file' not in zip_description or 'contents_file' not in zip_description:
+            continue
+
+        result[zip_id] = {
+            'fingerprint': zip_fingerprint(zip_description),
+            'summary_file': {**zip_description['summary_file']},
+            'contents_file': {**zip_description['contents_file']},
+        }
+    return result
 
-        summary_file_zip = save_summary_file_zip(zip_id, summary_file_content)
-        zip_description['summary_file'] = {**new_file_description(summary_file_zip), 'url': f'{base_zips_url}{summary_file_zip}'}
-        contents_file_zip = save_contents_file_zip(zip_id, summary_file_content, zip_description['path'])
-        zip_description['contents_file'] = {**new_file_description(contents_file_zip), 'url': f'{base_zips_url}{contents_file_zip}'}
+def set_zips_branch_base_url(zips: Dict[str, Any], sha: str) -> None:
+    for zip_description in zips.values():
+        for key in ['summary_file', 'contents_file']:
+            zip_description[key]['url'] = zip_description[key]['url'].replace('<ZIPS_BRANCH_BASE_URL>', sha)
 
-def save_summary_file_zip(zip_id: str, summary_file_content: Dict[str, Any]) -> str:
+def save_summary_file_zip(store: ArtifactStore, zip_id: str, summary_file_content: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
     summary_file_zip = f'{zip_id}_summary.json.zip'
-    with ZipFile(summary_file_zip, 'w', compression=ZIP_DEFLATED, compresslevel=1) as zipf:
-        zipf.writestr(f'{zip_id}_summary.json', json.dumps(summary_file_content, sort_keys=True))
-    return summary_file_zip
+    return summary_file_zip, store.save(summary_file_zip, summary_file_zip_bytes(zip_id, summary_file_content))
+
+def summary_file_zip_bytes(zip_id: str, summary_file_content: Dict[str, Any]) -> bytes:
+    buffer = io.BytesIO()
+    with ZipFile(buffer, 'w') as zipf:
+        write_zip_member(zipf, f'{zip_id}_summary.json', json.dumps(summary_file_content, sort_keys=True).encode())
+    return buffer.getvalue()
 
-def save_contents_file_zip(zip_id: str, summary_file_content: Dict[str, Any], zip_path: str) -> str:
+def save_contents_file_zip(store: ArtifactStore, zip_id: str, summary_file_content: Dict[str, Any], zip_path: str) -> Tuple[str, Dict[str, Any]]:
     contents_file_zip = f'{zip_id}.zip'
-    with ZipFile(contents_file_zip, 'w', compression=ZIP_DEFLATED, compresslevel=1) as zipf:
-        for file in summary_file_content['files']:
-            source = file
-            if source[0] == '|':
-                source = source[1:]
-            target = file
-            if target.find(zip_path) == 0:
-                target = target[len(zip_path):]
-            zipf.write(source, target)
-    return contents_file_zip
+    members: List[Tuple[str, str]] = []
+    for file in summary_file_content['files']:
+        source = file
+        if source[0] == '|':
+            source = source[1:]
+        target = file
+        if target.find(zip_path) == 0:
+            target = target[len(zip_path):]
+        members.append((target, source))
+
+    buffer = io.BytesIO()
+    with ZipFile(buffer, 'w') as zipf:
+        for target, source in sorted(members):
+            with open(source, 'rb') as f:
+                write_zip_member(zipf, target, f.read())
+    return contents_file_zip, store.save(contents_file_zip, buffer.getvalue())
+
+def save_json_and_zip(content: Dict[str, Any], json_name: str, indent: Optional[int]) -> None:
+    # The zip of the db is produced from the same serialized bytes as the plain JSON.
+    # Members opened for writing use the default deflate level.
+    with open(json_name, 'wb') as f, ZipFile(f'{json_name}.zip', 'w') as zipf, zipf.open(zip_member_info(Path(json_name).name), 'w') as zf:
+        for chunk in _json_chunks_fn(content, indent):
+            data = chunk.encode()
+            f.write(data)
+            zf.write(data)
+
+zip_member_date_time = (2021, 8, 23, 14, 5, 0)
+
+def zip_member_info(name: str) -> ZipInfo:
+    # Nothing from the checkout (mtimes, permissions, host OS) ends up in the archive,
+    # so identical inputs always produce byte-identical zips.
+    zinfo = ZipInfo(name, date_time=zip_member_date_time)
+    zinfo.create_system = 3
+    zinfo.external_attr = 0o100644 << 16
+    zinfo.compress_type = ZIP_DEFLATED
+    return zinfo
+
+def write_zip_member(zipf: ZipFile, name: str, data: bytes) -> None:
+    zipf.writestr(zip_member_info(name), data, compresslevel=1)
+
+# JSON serializers. All of them produce the same bytes as json.dumps(content, indent=indent, sort_keys=True).
+
+def oneshot_json_chunks(content: Dict[str, Any], indent: Optional[int]) -> Iterator[str]:
+    yield json.dumps(content, indent=indent, sort_keys=True)
+
+def streaming_json_chunks(content: Dict[str, Any], indent: Optional[int]) -> Iterator[str]:
+    # Emits one entry of each top-level section at a time, so the whole document is never held in memory.
+    if indent is not None:
+        yield from oneshot_json_chunks(content, indent)
+        return
+
+    yield '{'
+    for i, key in enumerate(sorted(content)):
+        yield ('' if i == 0 else ', ') + json.dumps(key) + ': '
+        value = content[key]
+        if isinstance(value, dict):
+            yield '{'
+            for j, entry_key in enumerate(sorted(value)):
+                yield ('' if j == 0 else ', ') + json.dumps(entry_key) + ': ' + json.dumps(value[entry_key], sort_keys=True)
+            yield '}'
+        else:
+            yield json.dumps(value, sort_keys=True)
+    yield '}'
+
+json_serializers = {
+    'oneshot': oneshot_json_chunks,
+    'streaming': streaming_json_chunks,
+}
+# Without the C accelerator, json.dumps runs the same pure Python encoder but keeps the whole document in memory.
+default_json_serializer = 'oneshot' if json.encoder.c_make_encoder is not None else 'streaming'  # type: ignore
+_json_chunks_fn = json_serializers[default_json_serializer]
+
+def set_json_serializer(name: str) -> None:
+    global _json_chunks_fn
+    _json_chunks_fn = json_serializers[name]
 
 def save_report_terms_in_readme(terms: List[str]) -> None:
     try:
@@ -764,93 +1474,159 @@ def save_report_terms_in_readme(terms: List[str]) -> None:
         print('FileNotFoundError: README.md', flush=True)
         print(e, flush=True)
 
-# MiSTer entity descriptions
-
-def new_file_description(name: str) -> Dict[str, Any]:
-    return {"size": file_size(name), "hash": file_hash(name)}
-
 # MiSTer XMLs
 
 def read_mra_fields(mra_path: Path) -> Tuple[Optional[str], List[str]]:
-    rbf = None
-    zips: Set[str] = set()
+    return read_xml_fields(mra_path, 'mra', _extract_mra_fields)
 
+def read_mgl_fields(mgl_path: Path) -> Tuple[Optional[str], Optional[str]]:
+    return read_xml_fields(mgl_path, 'mgl', _extract_mgl_fields)
+
+def read_xml_fields(xml_path: Path, kind: str, extract: Any) -> Any:
+    if tracer.enabled:
+        start = time.perf_counter()
+        try:
+            return _read_xml_fields(xml_path, kind, extract)
+        finally:
+            tracer.record_file(f'{kind} parse', str(xml_path), time.perf_counter() - start)
+    return _read_xml_fields(xml_path, kind, extract)
+
+def _read_xml_fields(xml_path: Path, kind: str, extract: Any) -> Any:
     try:
-        context = et_iterparse(str(mra_path), events=("start",))
-        for _, elem in context:
-            elem_tag = elem.tag.lower()
-            if elem_tag == 'rbf':
-                if rbf is not None:
-                    print('WARNING! Duplicated rbf tag on file %s, first value %s, later value %s' % (str(mra_path),rbf,elem.text))
-                    continue
-                if elem.text is None:
-                    continue
-                rbf = elem.text.strip().lower()
-            elif elem_tag == 'rom':
-                attributes = {k.strip().lower(): v for k, v in elem.attrib.items()}
-                if 'zip' in attributes and attributes['zip'] is not None:
-                    zips |= {z.strip().lower() for z in attributes['zip'].strip().lower().split('|')}
+        try:
+            return extract(xml_path, stream_xml_elements(str(xml_path), xml_text_tags))
+        except ET.ParseError:
+            # Files with tags that only match each other case-insensitively, like <RBF>...</rbf>, are still accepted by the legacy reader.
+            return extract(xml_path, legacy_xml_elements(str(xml_path)))
     except ET.ParseError as e:
-        print('ERROR: Defect XML for mra file: ' + str(mra_path))
+        print(f'ERROR: Defect XML for {kind} file: ' + str(xml_path))
         raise e
-   
+
+def _extract_mra_fields(mra_path: Path, elements: Iterator[Tuple[str, Dict[str, str], Optional[str]]]) -> Tuple[Optional[str], List[str]]:
+    rbf = None
+    zips: Set[str] = set()
+
+    for elem_tag, elem_attrib, elem_text in elements:
+        if elem_tag == 'rbf':
+            if rbf is not None:
+                print('WARNING! Duplicated rbf tag on file %s, first value %s, later value %s' % (str(mra_path),rbf,elem_text))
+                continue
+            if elem_text is None:
+                continue
+            rbf = elem_text.strip().lower()
+        elif elem_tag == 'rom':
+            attributes = {k.strip().lower(): v for k, v in elem_attrib.items()}
+            if 'zip' in attributes and attributes['zip'] is not None:
+                zips |= {z.strip().lower() for z in attributes['zip'].strip().lower().split('|')}
+
     return rbf, list(zips)
 
-def read_mgl_fields(mgl_path: Path) -> Tuple[Optional[str], Optional[str]]:
+def _extract_mgl_fields(mgl_path: Path, elements: Iterator[Tuple[str, Dict[str, str], Optional[str]]]) -> Tuple[Optional[str], Optional[str]]:
     rbf = None
     setname = None
 
-    try:
-        context = et_iterparse(str(mgl_path), events=("start",))
-        for _, elem in context:
-            elem_tag = elem.tag.lower()
-            if elem_tag == 'rbf':
-                if rbf is not None:
-                    print('WARNING! Duplicated rbf tag on file %s, first value %s, later value %s' % (str(mgl_path),rbf,elem.text))
-                    continue
-                if elem.text is None:
-                    continue
-                rbf = elem.text.strip().lower()
-            elif setname == 'rom':
-                if setname is not None:
-                    print('WARNING! Duplicated setname tag on file %s, first value %s, later value %s' % (str(mgl_path),setname,elem.text))
-                    continue
-                if elem.text is None:
-                    continue
-                setname = elem.text.strip().lower()
-    except ET.ParseError as e:
-        print('ERROR: Defect XML for mgl file: ' + str(mgl_path))
-        raise e
+    for elem_tag, _, elem_text in elements:
+        if elem_tag == 'rbf':
+            if rbf is not None:
+                print('WARNING! Duplicated rbf tag on file %s, first value %s, later value %s' % (str(mgl_path),rbf,elem_text))
+                continue
+            if elem_text is None:
+                continue
+            rbf = elem_text.strip().lower()
+        elif elem_tag == 'setname':
+            if setname is not None:
+                print('WARNING! Duplicated setname tag on file %s, first value %s, later value %s' % (str(mgl_path),setname,elem_text))
+                continue
+            if elem_text is None:
+                continue
+            setname = elem_text.strip().lower()
+
+        if rbf is not None and setname is not None:
+            break
 
     return rbf, setname
 
+xml_text_tags = {'rbf', 'setname'}
+
 # MiSTer network utilities
 
 def download_db(url: str) -> Dict[str, Any]:
-    with tempfile.NamedTemporaryFile() as tf:
-        download_file(url, tf.name)
-        return unzip_json(tf.name)
+    return decode_db(http_transport.get(url).body)
 
-def get_url_db(url: str) -> Dict[str, Any]:
+def decode_db(body: bytes) -> Dict[str, Any]:
+    return unzip_json_bytes(body) if is_zip_bytes(body) else json.loads(body)
+
+def get_url_db(url: str, summaries: bool = True, cache: Optional['DownloadCache'] = None) -> Dict[str, Any]:
+    cache = cache or DownloadCache(None)
     print("Downloading db from " + url)
     try:
         db = load_json(url) if is_json(url) else unzip_json(url)
     except Exception as _:
-        db = download_db(url)
+        db = cache.db(url)
 
-    if 'zips' not in db:
+    if 'zips' not in db or not summaries:
         return db
-    
-    for zip in db['zips'].values():
-        summary_url = zip['summary_file']['url']
-        try:
-            zip['summary_file_content'] = get_summary_file_content(summary_url)
-        except ReturnCodeException as e:
-            print('ReturnCodeException at get_summary_file_content ' + summary_url)
-            print(e)
 
+    load_zip_summaries(db, db['zips'], cache)
     return db
 
+def load_zip_summaries(db: Dict[str, Any], zip_ids: Iterable[str], cache: 'DownloadCache') -> None:
+    zip_descriptions = [db['zips'][zip_id] for zip_id in zip_ids if 'summary_file_content' not in db['zips'][zip_id]]
+    if len(zip_descriptions) == 0:
+        return
+
+    jobs = min(max_concurrent_downloads, len(zip_descriptions))
+    fetch = lambda zip_description: try_get_summary_file_content(zip_description, cache)
+    for zip_description, summary_file_content in zip(zip_descriptions, parallel_map(fetch, zip_descriptions, jobs, chunksize=1)):
+        if summary_file_content is not None:
+            zip_description['summary_file_content'] = summary_file_content
+
+max_concurrent_downloads = 8
+
+def resolve_previous_summaries(previous_db: Dict[str, Any], db: Dict[str, Any], cache: 'DownloadCache') -> None:
+    # A previous summary that is byte-identical to the one the new db would write has the same content,
+    # so it is taken from the new db. Only the rest are downloaded.
+    pending: List[str] = []
+    unchanged = 0
+    same_tags = previous_db.get('tag_dictionary') == db.get('tag_dictionary')
+    for zip_id, previous_zip in previous_db.get('zips', {}).items():
+        if 'summary_file_content' in previous_zip:
+            continue
+
+        zip_description = db.get('zips', {}).get(zip_id)
+        if same_tags and zip_description is not None and is_same_zip_summary(zip_id, previous_zip, zip_description):
+            previous_zip['summary_file_content'] = zip_description['summary_file_content']
+            unchanged += 1
+        else:
+            pending.append(zip_id)
+
+    print(f'Previous zip summaries: {unchanged} unchanged, {len(pending)} to download.')
+    load_zip_summaries(previous_db, pending, cache)
+
+def is_same_zip_summary(zip_id: str, previous_zip: Dict[str, Any], zip_description: Dict[str, Any]) -> bool:
+    for key in ['raw_files_size', 'contents', 'path']:
+        if previous_zip.get(key) != zip_description.get(key):
+            return False
+
+    previous_hash = previous_zip.get('summary_file', {}).get('hash')
+    return previous_hash == hashlib.md5(summary_file_zip_bytes(zip_id, zip_description['summary_file_content'])).hexdigest()
+
+def same_summary_zip_ids(left_db: Dict[str, Any], right_db: Dict[str, Any]) -> Set[str]:
+    if left_db.get('tag_dictionary') != right_db.get('tag_dictionary'):
+        return set()
+
+    left_zips, right_zips = left_db.get('zips', {}), right_db.get('zips', {})
+    return {zip_id for zip_id in left_zips if zip_id in right_zips and left_zips[zip_id]['summary_file'].get('hash') == right_zips[zip_id]['summary_file'].get('hash')}
+
+def try_get_summary_file_content(zip_description: Dict[str, Any], cache: 'DownloadCache') -> Optional[Dict[str, Any]]:
+    summary_url = zip_description['summary_file']['url']
+    try:
+        return cache.summary(summary_url, zip_description['summary_file'].get('hash', ''))
+    except (ReturnCodeException, HttpException, BadZipFile, ValueError) as e:
+        print(f'{type(e).__name__} at get_summary_file_content ' + summary_url)
+        print(e)
+        return None
+
 def get_summary_file_content(url: str) -> Dict[str, Any]:
     summary = download_db(url)
     content: Dict[str, Any] = {'files': {}, 'folders': {}}
@@ -863,8 +1639,10 @@ def get_summary_file_content(url: str) -> Dict[str, Any]:
     return content
 
 def get_linux_latest_release_url(linux_github_repository: str, github_token: str) -> str:
-    auth = '' if github_token == '' else f'-H "Authorization: Bearer {github_token}"'
-    sd_installer_output = run_stdout(f'curl --fail --location --silent -H "Accept: application/vnd.github.v3+json" {auth} https://api.github.com/repos/{linux_github_repository}/git/trees/HEAD')
+    headers = {'Accept': 'application/vnd.github.v3+json'}
+    if github_token != '':
+        headers['Authorization'] = f'Bearer {github_token}'
+    sd_installer_output = http_transport.get(f'https://api.github.com/repos/{linux_github_repository}/git/trees/HEAD', headers).body.decode()
     try:
         sd_installer_json = json.loads(sd_installer_output)
     except Exception as e:
@@ -878,57 +1656,409 @@ def get_linux_latest_release_url(linux_github_repository: str, github_token: str
 
 # db diff tooling
 
-def mut_diff_db(left_db: Dict[str, Any], right_db: Dict[str, Any]) -> bool:
-    reformat_db_for_comparison(left_db)
-    reformat_db_for_comparison(right_db)
+def tag_names_by_index(db: Dict[str, Any]) -> Dict[int, str]:
+    # With aliases, several words share an index, and the last one in sorted order names it.
+    tag_dictionary = db.get('tag_dictionary', {})
+    return {tag_dictionary[word]: word for word in sorted(tag_dictionary)}
 
-    left_str = json.dumps(left_db, sort_keys=True)
-    right_str = json.dumps(right_db, sort_keys=True)
+def normalized_entry(entry: Dict[str, Any], indexes: Dict[int, str]) -> Dict[str, Any]:
+    if 'tags' not in entry and 'url' not in entry:
+        return entry
 
-    with tempfile.NamedTemporaryFile() as temp_left, tempfile.NamedTemporaryFile() as temp_right:
-        with open(temp_left.name, 'w') as ndf, open(temp_right.name, 'w') as odf:
-            print(json.dumps(left_db, sort_keys=True, indent=True), file=ndf)
-            print(json.dumps(right_db, sort_keys=True, indent=True), file=odf)
-        try:
-            run(f'git diff --no-index --exit-code {temp_left.name} {temp_right.name}')
-        except ReturnCodeException as _:
-            print('RED[-] is left, GREEN[+] is right')
-            pass
+    result = {**entry}
+    if 'tags' in entry:
+        result['tags'] = sorted([indexes[t] for t in entry['tags']])
+    if 'url' in entry:
+        result['url'] = ''
+    return result
 
-    return left_str == right_str
+class DigestNode:
+    def __init__(self, digest: str, children: Optional[Dict[str, 'DigestNode']] = None):
+        self.digest = digest
+        self.children = children
 
-def reformat_db_for_comparison(db: Dict[str, Any]) -> None:
-    db['base_files_url'] = ''
-    db['latest_zip_url'] = ''
-    db['timestamp'] = 0
-    db['db_files'] = []
-    db['db_url'] = db.get('db_url', '')
-    db['default_options'] = db.get('default_options', {})
+    @staticmethod
+    def leaf(value: Any) -> 'DigestNode':
+        return DigestNode(hashlib.md5(json.dumps(value, sort_keys=True).encode()).hexdigest())
 
-    indexes: Dict[int, str] = {db['tag_dictionary'][word]: word for word in sorted(db.get('tag_dictionary', {}))}
+    @staticmethod
+    def parent(children: Dict[str, 'DigestNode']) -> 'DigestNode':
+        digest = hashlib.md5()
+        for key in sorted(children):
+            digest.update(f'{key}\0{children[key].digest}\n'.encode())
+        return DigestNode(digest.hexdigest(), children=children)
+
+class DbDigest:
+    # Merkle tree of a db: one hash per entry, rolled up per folder, per zip and per section.
+    # Fields that change on every build (urls, timestamps, zip artifacts) are left out,
+    # and tags are compared by name, since indexes depend on the order in which tags were found.
+    def __init__(self, db: Dict[str, Any]):
+        self._indexes = tag_names_by_index(db)
+
+        sections: Dict[str, DigestNode] = {}
+        for key, value in db.items():
+            if key in ['files', 'folders']:
+                sections[key] = self._entries_node(value)
+            elif key == 'zips':
+                sections[key] = DigestNode.parent({zip_id: self._zip_node(zip_description) for zip_id, zip_description in value.items()})
+            elif key == 'tag_dictionary':
+                sections[key] = DigestNode.leaf(sorted(value))
+            else:
+                sections[key] = DigestNode.leaf(value)
+
+        for key, value in db_digest_ignored_fields.items():
+            sections[key] = DigestNode.leaf(value)
+        for key, value in db_digest_default_fields.items():
+            if key not in sections:
+                sections[key] = DigestNode.leaf(value)
+        if 'tag_dictionary' not in sections:
+            sections['tag_dictionary'] = DigestNode.leaf([])
+
+        self.root = DigestNode.parent(sections)
+
+    def zip_nodes(self) -> Dict[str, DigestNode]:
+        zips = (self.root.children or {}).get('zips')
+        return zips.children or {} if zips is not None else {}
+
+    def entries_node(self, section: str, zip_id: str = '') -> Optional[DigestNode]:
+        # Top level entries with an empty zip_id, otherwise the entries of that zip summary.
+        if zip_id == '':
+            return (self.root.children or {}).get(section)
+
+        zip_node = self.zip_nodes().get(zip_id)
+        summary = (zip_node.children or {}).get('summary_file_content') if zip_node is not None else None
+        return (summary.children or {}).get(section) if summary is not None else None
+
+    def _entries_node(self, entries: Dict[str, Any]) -> DigestNode:
+        folders: Dict[str, Dict[str, DigestNode]] = {}
+        for path, entry in entries.items():
+            folder, _, name = path.rpartition('/')
+            folders.setdefault(folder or '.', {})[name] = DigestNode.leaf(normalized_entry(entry, self._indexes))
+        return DigestNode.parent({folder: DigestNode.parent(children) for folder, children in folders.items()})
+
+    def _zip_node(self, zip_description: Dict[str, Any]) -> DigestNode:
+        description = {key: value for key, value in zip_description.items() if key != 'summary_file_content'}
+        description.update(zip_digest_ignored_fields)
+        children = {'description': DigestNode.leaf(description)}
+        if 'summary_file_content' in zip_description:
+            children['summary_file_content'] = DigestNode.parent({
+                key: self._entries_node(zip_description['summary_file_content'][key]) for key in ['files', 'folders']
+            })
+        return DigestNode.parent(children)
+
+db_digest_ignored_fields = {'base_files_url': '', 'latest_zip_url': '', 'timestamp': 0, 'db_files': []}
+db_digest_default_fields = {'db_url': '', 'default_options': {}}
+zip_digest_ignored_fields = {'base_files_url': '', 'contents_file': {}, 'summary_file': {}}
+
+def diff_databases(left_db: Dict[str, Any], right_db: Dict[str, Any], left_digest: Optional[DbDigest] = None, right_digest: Optional[DbDigest] = None) -> Dict[str, Any]:
+    # Semantic differences between two dbs, with the same normalization as DbDigest.
+    # The digests guide the diff: only zips and folders whose digests differ get their entries compared.
+    # Entries are indexed by (summary, path), since zip summaries repeat their outer folders.
+    left_digest = left_digest if left_digest is not None else DbDigest(left_db)
+    right_digest = right_digest if right_digest is not None else DbDigest(right_db)
+    left_indexes, right_indexes = tag_names_by_index(left_db), tag_names_by_index(right_db)
+    left_zips, right_zips = left_digest.zip_nodes(), right_digest.zip_nodes()
+    changed_zip_ids = sorted(zip_id for zip_id in left_zips.keys() | right_zips.keys() if _node_digest(left_zips.get(zip_id)) != _node_digest(right_zips.get(zip_id)))
+
+    result: Dict[str, Any] = {}
+    for section in ['files', 'folders']:
+        changed_folders = {summary: _changed_children(left_digest.entries_node(section, summary), right_digest.entries_node(section, summary)) for summary in ['', *changed_zip_ids]}
+        result[section] = _diff_entries(_section_entries(left_db, section, left_indexes, changed_folders), _section_entries(right_db, section, right_indexes, changed_folders))
+
+    result['zips'] = _diff_entries(_zip_entries(left_db, changed_zip_ids), _zip_entries(right_db, changed_zip_ids))
+
+    left_tags, right_tags = set(left_db.get('tag_dictionary', {})), set(right_db.get('tag_dictionary', {}))
+    result['tag_dictionary'] = {'added': sorted(right_tags - left_tags), 'removed': sorted(left_tags - right_tags)}
+
+    fields: Dict[str, Any] = {}
+    ignored_fields = {'files', 'folders', 'zips', 'tag_dictionary', *db_digest_ignored_fields}
+    for key in sorted({*left_db, *right_db, *db_digest_default_fields} - ignored_fields):
+        left_value = left_db.get(key, db_digest_default_fields.get(key))
+        right_value = right_db.get(key, db_digest_default_fields.get(key))
+        if left_value != right_value:
+            fields[key] = [left_value, right_value]
+    result['fields'] = fields
+
+    files = result['files']
+    size_delta = sum(entry.get('size', 0) for entry in files['added']) - sum(entry.get('size', 0) for entry in files['removed'])
+    size_delta += sum(change['size'][1] - change['size'][0] for change in files['changed'] if 'size' in change and None not in change['size'])
+    result['totals'] = {
+        **{section: {change: len(result[section][change]) for change in ['added', 'removed', 'changed']} for section in ['files', 'folders', 'zips']},
+        'size_delta': size_delta,
+    }
+    return result
 
-    reformat_elements(indexes, db['files'].values())
-    reformat_elements(indexes, db['folders'].values())
+def _node_digest(node: Optional[DigestNode]) -> Optional[str]:
+    return node.digest if node is not None else None
 
-    for zip_description in db.get('zips', {}).values():
-        zip_description['base_files_url'] = ''
-        zip_description['contents_file'] = {}
-        zip_description['summary_file'] = {}
+def _changed_children(left: Optional[DigestNode], right: Optional[DigestNode]) -> Set[str]:
+    if _node_digest(left) == _node_digest(right):
+        return set()
 
-        if 'summary_file_content' in zip_description:
-            reformat_elements(indexes, zip_description['summary_file_content']['files'].values())
-            reformat_elements(indexes, zip_description['summary_file_content']['folders'].values())
+    left_children = left.children or {} if left is not None else {}
+    right_children = right.children or {} if right is not None else {}
+    return {key for key in left_children.keys() | right_children.keys() if _node_digest(left_children.get(key)) != _node_digest(right_children.get(key))}
+
+def _section_entries(db: Dict[str, Any], section: str, indexes: Dict[int, str], changed_folders: Dict[str, Set[str]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    # Same folder keys as DbDigest._entries_node.
+    result: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for summary, folders in changed_folders.items():
+        if len(folders) == 0:
+            continue
+
+        entries = db.get(section, {}) if summary == '' else db.get('zips', {}).get(summary, {}).get('summary_file_content', {}).get(section, {})
+        for path, entry in entries.items():
+            if (path.rpartition('/')[0] or '.') in folders:
+                result[(summary, path)] = normalized_entry(entry, indexes)
+    return result
+
+def _zip_entries(db: Dict[str, Any], zip_ids: List[str]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    zips = db.get('zips', {})
+    return {
+        ('', zip_id): {**{key: value for key, value in zips[zip_id].items() if key != 'summary_file_content'}, **zip_digest_ignored_fields}
+        for zip_id in zip_ids if zip_id in zips
+    }
+
+def _diff_entries(left: Dict[Tuple[str, str], Dict[str, Any]], right: Dict[Tuple[str, str], Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    result: Dict[str, List[Dict[str, Any]]] = {
+        'added': [{**_entry_location(key), **_entry_summary(right[key])} for key in sorted(right.keys() - left.keys())],
+        'removed': [{**_entry_location(key), **_entry_summary(left[key])} for key in sorted(left.keys() - right.keys())],
+        'changed': [],
+    }
+    for key in sorted(left.keys() & right.keys()):
+        left_entry, right_entry = left[key], right[key]
+        if left_entry == right_entry:
+            continue
+
+        change: Dict[str, Any] = _entry_location(key)
+        left_tags, right_tags = set(left_entry.get('tags', [])), set(right_entry.get('tags', []))
+        if left_tags != right_tags:
+            change['tags_added'] = sorted(right_tags - left_tags)
+            change['tags_removed'] = sorted(left_tags - right_tags)
+        for field in sorted({*left_entry, *right_entry} - {'tags'}):
+            if left_entry.get(field) != right_entry.get(field):
+                change[field] = [left_entry.get(field), right_entry.get(field)]
+        result['changed'].append(change)
+    return result
+
+def _entry_location(key: Tuple[str, str]) -> Dict[str, Any]:
+    summary, path = key
+    return {'path': path, 'summary': summary} if summary != '' else {'path': path}
+
+def _entry_summary(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: entry[key] for key in ['size', 'hash', 'tags', 'zip_id'] if key in entry}
+
+def db_diff_as_text(db_diff: Dict[str, Any]) -> str:
+    lines: List[str] = []
+    for section in ['files', 'folders', 'zips']:
+        changes = db_diff[section]
+        for entry in changes['added']:
+            lines.append(f'+ {section[0:-1]} {_entry_location_text(entry)}{_entry_summary_text(entry)}')
+        for entry in changes['removed']:
+            lines.append(f'- {section[0:-1]} {_entry_location_text(entry)}{_entry_summary_text(entry)}')
+        for change in changes['changed']:
+            details = []
+            if 'tags_added' in change or 'tags_removed' in change:
+                details.append('tags ' + ' '.join([*[f'+{tag}' for tag in change['tags_added']], *[f'-{tag}' for tag in change['tags_removed']]]))
+            for key, (left, right) in sorted((key, value) for key, value in change.items() if key not in ['path', 'summary', 'tags_added', 'tags_removed']):
+                if key == 'size' and isinstance(left, int) and isinstance(right, int):
+                    details.append(f'size {left} -> {right} ({right - left:+d})')
+                else:
+                    details.append(f'{key} {json.dumps(left)} -> {json.dumps(right)}')
+            lines.append(f'~ {section[0:-1]} {_entry_location_text(change)}: ' + ', '.join(details))
+
+    tag_dictionary = db_diff['tag_dictionary']
+    if tag_dictionary['added'] or tag_dictionary['removed']:
+        lines.append('~ tag_dictionary: ' + ' '.join([*[f'+{tag}' for tag in tag_dictionary['added']], *[f'-{tag}' for tag in tag_dictionary['removed']]]))
+    for key, (left, right) in db_diff['fields'].items():
+        lines.append(f'~ field {key}: {json.dumps(left)} -> {json.dumps(right)}')
+
+    totals = db_diff['totals']
+    lines.append('Totals: ' + ', '.join(
+        f'{section} +{totals[section]["added"]} -{totals[section]["removed"]} ~{totals[section]["changed"]}' for section in ['files', 'folders', 'zips']
+    ) + f', size {totals["size_delta"]:+d} bytes')
+    return '\n'.join(lines)
+
+def _entry_location_text(entry: Dict[str, Any]) -> str:
+    return f'{entry["path"]} [summary {entry["summary"]}]' if 'summary' in entry else entry['path']
+
+def _entry_summary_text(entry: Dict[str, Any]) -> str:
+    details = []
+    if 'size' in entry:
+        details.append(f'{entry["size"]} bytes')
+    if 'tags' in entry:
+        details.append('tags ' + ' '.join(entry['tags']))
+    if 'zip_id' in entry and entry['zip_id'] != entry.get('summary'):
+        details.append(f'in zip {entry["zip_id"]}')
+    return f' ({", ".join(details)})' if details else ''
+
+# build tracing
+
+class Span:
+    def __init__(self, name: str, depth: int):
+        self.name = name
+        self.depth = depth
+        self.counts: Dict[str, int] = {}
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_kb: Optional[int] = None
+
+    def count(self, **counts: int) -> None:
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def finish(self) -> None:
+        self.seconds = time.perf_counter() - self.start
+        self.cpu_seconds = time.process_time() - self.cpu_start
+        self.peak_rss_kb = peak_rss_kb()
+
+class Tracer:
+    # Spans over the phases of a build, plus the slowest individual files of each kind.
+    # Spans always nest on the main thread, per file records may come from any worker.
+    def __init__(self) -> None:
+        self.enabled = False
+        self._top_files = 0
+        self._origin = time.perf_counter()
+        self._depth = 0
+        self._spans: List[Span] = []
+        self._slowest_files: Dict[str, List[Tuple[float, str, Optional[int]]]] = {}
+        self._lock = threading.Lock()
+
+    def enable(self, top_files: int) -> None:
+        self.enabled = True
+        self._top_files = top_files
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[Span]:
+        span = Span(name, self._depth)
+        self._depth += 1
+        try:
+            yield span
+        finally:
+            self._depth -= 1
+            if self.enabled:
+                span.finish()
+                self._spans.append(span)
+            if span.depth == 0:
+                profiler.snapshot(name)
+
+    def record_file(self, kind: str, path: str, seconds: float, size: Optional[int] = None) -> None:
+        with self._lock:
+            slowest = self._slowest_files.setdefault(kind, [])
+            heapq.heappush(slowest, (seconds, path, size))
+            if len(slowest) > self._top_files:
+                heapq.heappop(slowest)
+
+    def print_report(self) -> None:
+        print()
+        print(f'{"phase":<32} {"wall s":>8} {"cpu s":>8} {"files":>8} {"MB":>9} {"peak RSS MB":>12}')
+        for span in sorted(self._spans, key=lambda span: span.start):
+            name = '  ' * span.depth + span.name
+            files = span.counts.get('files')
+            size = span.counts.get('bytes')
+            print(f'{name:<32} {span.seconds:>8.3f} {span.cpu_seconds:>8.3f} {"" if files is None else files:>8} {"" if size is None else f"{size / 1000000:.1f}":>9} {"" if span.peak_rss_kb is None else f"{span.peak_rss_kb / 1024:.1f}":>12}')
+
+        for kind, slowest in sorted(self.slowest_files().items()):
+            print()
+            print(f'Slowest files by {kind}:')
+            for file in slowest:
+                print(f'{file["seconds"] * 1000:>10.2f} ms  {file["path"]}' + ('' if file['bytes'] is None else f' ({file["bytes"]} bytes)'))
+
+    def slowest_files(self) -> Dict[str, List[Dict[str, Any]]]:
+        with self._lock:
+            return {
+                kind: [{'path': path, 'seconds': seconds, 'bytes': size} for seconds, path, size in sorted(slowest, reverse=True)]
+                for kind, slowest in self._slowest_files.items()
+            }
+
+    def write(self, path: str) -> None:
+        # Chrome trace event format, loadable in chrome://tracing or Perfetto.
+        pid = os.getpid()
+        events = [{
+            'name': span.name,
+            'cat': 'build',
+            'ph': 'X',
+            'ts': (span.start - self._origin) * 1000000,
+            'dur': span.seconds * 1000000,
+            'pid': pid,
+            'tid': 0,
+            'args': {'cpu_seconds': span.cpu_seconds, 'peak_rss_kb': span.peak_rss_kb, **span.counts},
+        } for span in sorted(self._spans, key=lambda span: span.start)]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'slowestFiles': self.slowest_files()}, f, indent=4)
+        print(f'Trace written to {path}')
+
+def peak_rss_kb() -> Optional[int]:
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return peak // 1024 if sys.platform == 'darwin' else peak
 
-    db['tag_dictionary'] = sorted(db.get('tag_dictionary', {}).keys())
+tracer = Tracer()
 
-def reformat_elements(indexes: Dict[int, str], collection: List[Dict[str, Any]]) -> None:
-    for dict in collection:
-        if 'tags' in dict:
-            dict['tags'] = sorted([indexes[t] for t in dict.get('tags', [])])
-        if 'url' in dict:
-            dict['url'] = ''
 # filesystem utilities
 
+def stream_xml_elements(xml: str, text_tags: Set[str]) -> Generator[Tuple[str, Dict[str, str], Optional[str]], None, None]:
+    target = XmlElementsTarget(text_tags)
+    parser = ET.XMLParser(target=target)
+    with open(xml, 'rb') as f:
+        chunk = f.read(xml_chunk_size)
+        while chunk:
+            parser.feed(chunk)
+            yield from target.pop_elements()
+            chunk = f.read(xml_chunk_size)
+    parser.close()
+    yield from target.pop_elements()
+
+xml_chunk_size = 16 * 1024
+
+class XmlElementsTarget:
+    def __init__(self, text_tags: Set[str]):
+        self._text_tags = text_tags
+        self._elements: List[Tuple[str, Dict[str, str], Optional[str]]] = []
+        self._pending: Optional[Tuple[str, Dict[str, str]]] = None
+        self._text: List[str] = []
+
+    def start(self, tag: str, attrib: Dict[str, str]) -> None:
+        self._flush()
+        tag = tag.lower()
+        if tag in self._text_tags:
+            self._pending = (tag, attrib)
+        else:
+            self._elements.append((tag, attrib, None))
+
+    def data(self, data: str) -> None:
+        if self._pending is not None:
+            self._text.append(data)
+
+    def end(self, tag: str) -> None:
+        self._flush()
+
+    def close(self) -> None:
+        self._flush()
+
+    def pop_elements(self) -> List[Tuple[str, Dict[str, str], Optional[str]]]:
+        elements = self._elements
+        self._elements = []
+        return elements
+
+    def _flush(self) -> None:
+        # Like ElementTree, an element text is the character data found before its first child.
+        if self._pending is None:
+            return
+        tag, attrib = self._pending
+        self._elements.append((tag, attrib, ''.join(self._text) if len(self._text) > 0 else None))
+        self._pending = None
+        self._text = []
+
+def legacy_xml_elements(xml: str) -> Generator[Tuple[str, Dict[str, str], Optional[str]], None, None]:
+    for _, elem in et_iterparse(xml, events=("start",)):
+        yield elem.tag.lower(), elem.attrib, elem.text
+
 def et_iterparse(xml: str, events: Tuple[str]) -> Iterator[Tuple[str, Any]]:
     try:
         with open(xml, 'r') as ftemp:
@@ -943,14 +2073,21 @@ def et_iterparse(xml: str, events: Tuple[str]) -> Iterator[Tuple[str, Any]]:
 def file_size(file: str) -> int:
     return os.path.getsize(file)
 
-def file_hash(file: str) -> str:
-    with open(file, "rb") as f:
-        file_hash = hashlib.md5()
-        chunk = f.read(8192)
-        while chunk:
-            file_hash.update(chunk)
-            chunk = f.read(8192)
-        return file_hash.hexdigest()
+def file_hash(file: str, size: Optional[int] = None) -> str:
+    # A known size saves the backends from stat-ing the file again.
+    if tracer.enabled:
+        start = time.perf_counter()
+        result = _file_hash_fn(file, size)
+        tracer.record_file('hash', file, time.perf_counter() - start, size if size is not None else file_size(file))
+        return result
+    return _file_hash_fn(file, size)
+
+default_hash_backend = 'mmap'
+_file_hash_fn = hash_backends[default_hash_backend]
+
+def set_hash_backend(name: str) -> None:
+    global _file_hash_fn
+    _file_hash_fn = hash_backends[name]
 
 def try_read_json(filename: str) -> Optional[Dict[str, Any]]:
     try:
@@ -964,7 +2101,20 @@ def load_json(filename: str) -> Dict[str, Any]:
         return json.load(f)
 
 def unzip_json(path: str) -> Dict[str, Any]:
-    return json.loads(run_stdout('unzip -p ' + path))
+    with ZipFile(path) as zipf:
+        return json_from_zip(zipf)
+
+def unzip_json_bytes(data: bytes) -> Dict[str, Any]:
+    with ZipFile(io.BytesIO(data)) as zipf:
+        return json_from_zip(zipf)
+
+def json_from_zip(zipf: ZipFile) -> Dict[str, Any]:
+    # Dbs and summaries are zips with a single JSON inside.
+    with zipf.open(zipf.infolist()[0]) as f:
+        return json.load(f)
+
+def is_zip_bytes(data: bytes) -> bool:
+    return data[0:4] == b'PK\x03\x04'
 
 def set_source_dir(source_dir: str):
     print('Source directory: ' + source_dir)
@@ -975,9 +2125,39 @@ def is_json(file: str):
 
 # network utilities
 
-def download_file(url: str, target: str) -> None:
-    Path(target).parent.mkdir(parents=True, exist_ok=True)
-    run(f'curl --show-error --fail --location -o "{target}" "{url}"')
+def download_file_description(url: str) -> Dict[str, Any]:
+    # Hashed while the bytes arrive, so big files never touch the disk.
+    sink = HashingSink()
+    http_transport.stream(url, cast(BinaryIO, sink))
+    return {"size": sink.size, "hash": sink.hexdigest()}
+
+class HashingSink(io.RawIOBase):
+    def __init__(self) -> None:
+        super().__init__()
+        self.size = 0
+        self._hash = hashlib.md5()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self._hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        # Retries rewind the sink to the start, so everything written so far gets discarded.
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('HashingSink can only rewind to the start')
+        self.size = 0
+        self._hash = hashlib.md5()
+        return 0
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        return self.size
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
 
 # execution utilities
 
@@ -987,8 +2167,11 @@ def run(command: str, cwd: Optional[str] = None) -> None:
 def run_stdout(command: str, cwd: Optional[str] = None) -> str:
     return _run(command, cwd, stderr=subprocess.DEVNULL, stdout=subprocess.PIPE).stdout.decode().strip()
 
-def _run(command: str, cwd: Optional[str], stderr: Optional[int], stdout: Optional[int]) -> Any:
-    result = subprocess.run(shlex.split(command), cwd=cwd, shell=False, stderr=subprocess.STDOUT, stdout=stdout)
+def run_input_stdout(command: str, input: bytes, cwd: Optional[str] = None) -> str:
+    return _run(command, cwd, stderr=subprocess.DEVNULL, stdout=subprocess.PIPE, input=input).stdout.decode().strip()
+
+def _run(command: str, cwd: Optional[str], stderr: Optional[int], stdout: Optional[int], input: Optional[bytes] = None) -> Any:
+    result = subprocess.run(shlex.split(command), cwd=cwd, shell=False, stderr=stderr, stdout=stdout, input=input)
     if result.returncode == -2:
         raise KeyboardInterrupt()
     elif result.returncode != 0:
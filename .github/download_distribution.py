@@ -14,7 +14,8 @@ import shlex
 import json
 import zipfile
 import xml.etree.ElementTree as ET
-import sys
+from argparse import ArgumentParser
+from shared_utilities import http_transport, profiler
 
 amount_of_cores_validation_limit = 200
 amount_of_extra_content_urls_validation_limit = 20
@@ -23,6 +24,13 @@ def main() -> None:
 
     start = time.time()
 
+    parser = ArgumentParser()
+    parser.add_argument('target', nargs='?', default='delme', help="Folder where the distribution gets downloaded")
+    parser.add_argument('--profile', choices=['cpu', 'memory'], help="Profile the whole run with cProfile (main thread only), or take tracemalloc snapshots after every phase")
+    args = parser.parse_args()
+
+    profiler.start(args.profile)
+
     cores = fetch_cores()
     extra_content_urls = fetch_extra_content_urls()
     extra_content_categories = classify_extra_content(extra_content_urls)
@@ -42,16 +50,18 @@ def main() -> None:
     print('Extra Content Categories:')
     print(json.dumps(extra_content_categories))
     print()
+    profiler.snapshot('fetch content lists')
 
-    target = 'delme'
-    if len(sys.argv) > 1:
-        target = sys.argv[1].strip()
+    target = args.target.strip()
 
     if 'delme' in target.lower():
         shutil.rmtree(target, ignore_errors=True)
         Path(target).mkdir(parents=True, exist_ok=True)
 
     process_all(extra_content_categories, cores, target)
+    http_transport.close()
+    profiler.stop('process_all')
+    profiler.print_report()
 
     print()
     print("Time:")
@@ -709,7 +719,7 @@ def is_valid_uri(x: str) -> bool:
 # network utilities
 
 def fetch_text(url: str) -> str:
-    return run_stdout(f'curl --fail --location --silent {url}')
+    return http_transport.get(url).body.decode()
 
 def download_repository(path: str, url: str, branch: str) -> None:
     if Path(path).exists():
@@ -720,8 +730,7 @@ def download_repository(path: str, url: str, branch: str) -> None:
     run(f'git -c protocol.version=2 clone -q --no-tags --no-recurse-submodules --depth=1 {minus_b} {url} {path}')
 
 def download_file(url: str, target: str) -> None:
-    Path(target).parent.mkdir(parents=True, exist_ok=True)
-    run(f'curl --show-error --fail --location -o "{target}" "{url}"')
+    http_transport.download(url, target)
 
 # execution utilities
 
@@ -3,33 +3,19 @@
 
 set -euo pipefail
 
-echo "Fetch unshallow"
-git fetch --unshallow origin
-
-git stash
 CUR_BRANCH=$(git rev-parse --abbrev-ref HEAD)
-ZIPS=$(git ls-files --directory . -o --exclude-standard | grep '.zip$')
-if [[ "${ZIPS}" != "" ]] ; then
-    echo "Adding ZIPs: ${ZIPS}"
-    git checkout --orphan zips
-    git reset
-    git add ${ZIPS}
-    git commit -m "-"
-    ZIPS_BRANCH_SHA=$(git rev-parse --verify HEAD)
-    echo "Writing ZIP SHA: ${ZIPS_BRANCH_SHA} to ${DB_JSON_NAME}"
-    sed -i "s/<ZIPS_BRANCH_BASE_URL>/${ZIPS_BRANCH_SHA}/g" "${DB_JSON_NAME}"
-    git checkout --force "${CUR_BRANCH}"
-fi
+
+# Only the current branch: the zips branch keeps every published archive in its history.
+echo "Fetch unshallow ${CUR_BRANCH}"
+git fetch --unshallow origin "${CUR_BRANCH}"
 DB_ZIP_NAME="${DB_JSON_NAME}.zip"
-echo "Creating ${DB_ZIP_NAME} from ${DB_JSON_NAME}."
 
-git stash pop
-zip "${DB_ZIP_NAME}" "${DB_JSON_NAME}"
+# db_operator.py already created ${DB_ZIP_NAME} and committed the new zips to the zips branch.
 git add "${DB_ZIP_NAME}"
 git add README.md
 git commit -m "-"
-if [[ "${ZIPS}" != "" ]] ; then
-    git push --force origin zips
+if git rev-parse --verify --quiet "refs/heads/${ZIPS_BRANCH:-zips}" > /dev/null ; then
+    git push --force origin "${ZIPS_BRANCH:-zips}"
 fi
 git push --force origin "${CUR_BRANCH}"
 
@@ -42,4 +28,4 @@ gh release download all_releases --pattern releases.txt || true
 DATE=$(date +"%Y-%m-%d %T")
 echo "$DATE: $(git rev-parse --verify HEAD)" >> releases.txt
 gh release create all_releases || true
-gh release upload all_releases releases.txt --clobber
\ No newline at end of file
+gh release upload all_releases releases.txt --clobber
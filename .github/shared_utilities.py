@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# Copyright (c) 2022 José Manuel Barroso Galindo <theypsilon@gmail.com>
+
+# Utilities shared by db_operator.py and download_distribution.py.
+
+import io
+import os
+import sys
+import time
+import json
+import hashlib
+import mmap
+import tempfile
+import threading
+import shutil
+import http.client
+import cProfile
+import pstats
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+from urllib.request import url2pathname
+
+# cache utilities
+
+def default_cache_dir() -> str:
+    # Per user: the caches are trusted as-is, so nobody else should be able to plant entries in them.
+    return str(Path(os.getenv('XDG_CACHE_HOME', '').strip() or Path.home() / '.cache', 'db_operator'))
+
+class XmlFieldsCache:
+    # MRA/MGL fields by file hash. Each script passes its own XML reader, so both keep the same cache file.
+    version = 1
+    file_name = 'xml_fields_cache.json'
+
+    def __init__(self, path: Optional[str]):
+        self._path = path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._today = int(time.time()) // 86400
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        if self._path is None:
+            return
+
+        try:
+            with open(self._path) as f:
+                content = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            print(f'WARNING! XML cache "{self._path}" is not valid JSON, ignoring it.')
+            return
+
+        if content.get('version') != self.version:
+            print(f'XML cache "{self._path}" belongs to another version, ignoring it.')
+            return
+
+        self._entries = content['entries']
+
+    def mra_fields(self, mra_path: Path, file_hash: Optional[str], read_fields: Callable[[Path], Tuple[Optional[str], List[str]]]) -> Tuple[Optional[str], List[str]]:
+        entry = self._lookup(file_hash, 'mra')
+        if entry is None:
+            rbf, zips = read_fields(mra_path)
+            entry = self._store(file_hash, 'mra', {'rbf': rbf, 'zips': sorted(zips)})
+        return entry['rbf'], entry['zips']
+
+    def mgl_fields(self, mgl_path: Path, file_hash: Optional[str], read_fields: Callable[[Path], Tuple[Optional[str], Optional[str]]]) -> Tuple[Optional[str], Optional[str]]:
+        entry = self._lookup(file_hash, 'mgl')
+        if entry is None:
+            rbf, setname = read_fields(mgl_path)
+            entry = self._store(file_hash, 'mgl', {'rbf': rbf, 'setname': setname})
+        return entry['rbf'], entry['setname']
+
+    def _lookup(self, file_hash: Optional[str], kind: str) -> Optional[Dict[str, Any]]:
+        if self._path is None or file_hash is None:
+            return None
+
+        entry = self._entries.get(f'{file_hash}.{kind}')
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                entry['last_used_day'] = self._today
+        return entry
+
+    def _store(self, file_hash: Optional[str], kind: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        entry = {**fields, 'last_used_day': self._today}
+        if self._path is not None and file_hash is not None:
+            self._entries[f'{file_hash}.{kind}'] = entry
+        return entry
+
+    def prune(self, max_age_days: int) -> int:
+        stale = [key for key, entry in self._entries.items() if self._today - entry['last_used_day'] >= max_age_days]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+
+        Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=str(Path(self._path).parent), delete=False) as f:
+            json.dump({'version': self.version, 'entries': self._entries}, f, sort_keys=True)
+        os.replace(f.name, self._path)
+
+    def print_stats(self) -> None:
+        if self._path is None:
+            print('XML cache: disabled')
+        else:
+            print(f'XML cache: {self.hits} hits, {self.misses} misses')
+
+    def print_entries(self) -> None:
+        print(f'XML cache: {self._path}')
+        for key, entry in sorted(self._entries.items(), key=lambda item: (item[1]['last_used_day'], item[0])):
+            fields = {k: v for k, v in entry.items() if k != 'last_used_day'}
+            print(f'{key} {time.strftime("%Y-%m-%d", time.gmtime(entry["last_used_day"] * 86400))} {json.dumps(fields, sort_keys=True)}')
+        print(f'{len(self._entries)} entries')
+
+# hashing
+
+def buffered_file_hash(file: str, size: Optional[int] = None) -> str:
+    with open(file, "rb") as f:
+        file_hash = hashlib.md5()
+        chunk = f.read(8192)
+        while chunk:
+            file_hash.update(chunk)
+            chunk = f.read(8192)
+        return file_hash.hexdigest()
+
+def chunked_file_hash(file: str, size: Optional[int] = None) -> str:
+    with open(file, "rb", buffering=0) as f:
+        if size is None:
+            size = os.fstat(f.fileno()).st_size
+        advise_sequential_read(f.fileno(), size)
+        buffer = bytearray(min(max(size, 1), max_hash_chunk_size))
+        view = memoryview(buffer)
+        file_hash = hashlib.md5()
+        read = f.readinto(buffer)
+        while read:
+            file_hash.update(view[:read])
+            read = f.readinto(buffer)
+        return file_hash.hexdigest()
+
+def mmap_file_hash(file: str, size: Optional[int] = None) -> str:
+    with open(file, "rb", buffering=0) as f:
+        if size is None:
+            size = os.fstat(f.fileno()).st_size
+        if size < mmap_min_size:
+            return hashlib.md5(f.read()).hexdigest()
+
+        advise_sequential_read(f.fileno(), size)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            return hashlib.md5(mapped).hexdigest()
+
+def advise_sequential_read(fd: int, size: int) -> None:
+    if not hasattr(os, 'posix_fadvise'):
+        return
+
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    if size >= mmap_min_size:
+        os.posix_fadvise(fd, 0, size, os.POSIX_FADV_WILLNEED)
+
+max_hash_chunk_size = 1024 * 1024
+mmap_min_size = 1024 * 1024
+
+hash_backends = {
+    'buffered': buffered_file_hash,
+    'chunked': chunked_file_hash,
+    'mmap': mmap_file_hash,
+}
+# network utilities
+
+@dataclass
+class HttpResponse:
+    url: str
+    status: int
+    headers: Dict[str, str]
+    body: bytes = b''
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    @property
+    def validators(self) -> Dict[str, str]:
+        return {key: self.headers[key] for key in ['etag', 'last-modified'] if key in self.headers}
+
+class HttpException(Exception):
+    pass
+
+class RetryableHttpException(Exception):
+    pass
+
+class HttpTransport:
+    # In-process HTTP client, safe to share between threads.
+    # Connections are kept alive and pooled per host, so consecutive requests skip the TCP and TLS handshakes.
+    def __init__(self, retries: int = 4, backoff_seconds: float = 0.5, timeout_seconds: float = 60, max_redirects: int = 10):
+        self._retries = retries
+        self._backoff_seconds = backoff_seconds
+        self._timeout_seconds = timeout_seconds
+        self._max_redirects = max_redirects
+        self._idle: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, validators: Optional[Dict[str, str]] = None) -> HttpResponse:
+        # With the validators of a previous response, a 304 response means that copy is still valid.
+        body = io.BytesIO()
+        response = self._send(url, headers or {}, validators or {}, body)
+        response.body = body.getvalue()
+        return response
+
+    def download(self, url: str, target: str) -> HttpResponse:
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        with open(target, 'wb') as f:
+            return self._send(url, {}, {}, f)
+
+    def stream(self, url: str, sink: BinaryIO) -> HttpResponse:
+        # The sink gets rewound with seek(0) and truncate() before every retry.
+        return self._send(url, {}, {}, sink)
+
+    def close(self) -> None:
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+    def _send(self, url: str, headers: Dict[str, str], validators: Dict[str, str], sink: BinaryIO) -> HttpResponse:
+        request_headers = {**headers}
+        if 'etag' in validators:
+            request_headers['If-None-Match'] = validators['etag']
+        if 'last-modified' in validators:
+            request_headers['If-Modified-Since'] = validators['last-modified']
+
+        for attempt in range(self._retries + 1):
+            sink.seek(0)
+            sink.truncate()
+            try:
+                return self._follow_redirects(url, request_headers, sink)
+            except (OSError, http.client.HTTPException, RetryableHttpException) as e:
+                if attempt == self._retries:
+                    raise HttpException(f'{url}: {e}') from e
+
+                wait = self._backoff_seconds * 2 ** attempt
+                print(f'Retrying {url} in {wait} seconds after: {e}', flush=True)
+                time.sleep(wait)
+
+        raise HttpException(url)
+
+    def _follow_redirects(self, url: str, headers: Dict[str, str], sink: BinaryIO) -> HttpResponse:
+        for _ in range(self._max_redirects + 1):
+            parts = urlsplit(url)
+            if parts.scheme == 'file':
+                with open(url2pathname(parts.path), 'rb') as f:
+                    shutil.copyfileobj(f, sink)
+                return HttpResponse(url, 200, {})
+
+            response = self._request(parts.scheme, parts.netloc, parts.path + (f'?{parts.query}' if parts.query else ''), headers, sink)
+            if response.status not in [301, 302, 303, 307, 308]:
+                return response
+
+            location = urljoin(url, response.headers['location'])
+            if urlsplit(location).netloc != parts.netloc:
+                headers = {key: value for key, value in headers.items() if key.lower() != 'authorization'}
+            url = location
+
+        raise HttpException(f'{url}: too many redirects')
+
+    def _request(self, scheme: str, netloc: str, path: str, headers: Dict[str, str], sink: BinaryIO) -> HttpResponse:
+        connection, reused = self._acquire(scheme, netloc)
+        try:
+            connection.request('GET', path or '/', headers=headers)
+            response = connection.getresponse()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            connection.close()
+            if not reused:
+                raise
+            # The server closed this idle connection in the meantime, a new one will do.
+            return self._request(scheme, netloc, path, headers, sink)
+        except BaseException:
+            connection.close()
+            raise
+
+        try:
+            result = HttpResponse(f'{scheme}://{netloc}{path}', response.status, {key.lower(): value for key, value in response.getheaders()})
+            if response.status == 200:
+                shutil.copyfileobj(response, sink, http_chunk_size)
+            else:
+                response.read()
+        except BaseException:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(scheme, netloc, connection)
+
+        if response.status >= 500 or response.status == 429:
+            raise RetryableHttpException(f'HTTP {response.status}')
+        if response.status >= 400:
+            raise HttpException(f'{result.url}: HTTP {response.status}')
+        return result
+
+    def _acquire(self, scheme: str, netloc: str) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self._timeout_seconds), False
+        elif scheme == 'http':
+            return http.client.HTTPConnection(netloc, timeout=self._timeout_seconds), False
+        raise HttpException(f'Unsupported scheme "{scheme}" for {netloc}')
+
+    def _release(self, scheme: str, netloc: str, connection: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(connection)
+
+http_chunk_size = 1024 * 1024
+http_transport = HttpTransport()
+
+# profiling
+
+class Profiler:
+    # Whole run profiling: cProfile for CPU, or a tracemalloc snapshot at the end of every phase for memory.
+    # Each memory snapshot is compared with the previous one, so the report shows what every phase allocated.
+    def __init__(self, top: int = 20) -> None:
+        self.mode: Optional[str] = None
+        self._top = top
+        self._cpu: Optional[cProfile.Profile] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._phases: List[Tuple[str, int, int, List[tracemalloc.StatisticDiff]]] = []
+
+    def start(self, mode: Optional[str]) -> None:
+        self.mode = mode
+        if mode == 'cpu':
+            self._cpu = cProfile.Profile()
+            self._cpu.enable()
+        elif mode == 'memory':
+            tracemalloc.start()
+            self._snapshot = self._take_snapshot()
+
+    def snapshot(self, phase: str) -> None:
+        if self.mode != 'memory' or self._snapshot is None:
+            return
+
+        snapshot = self._take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        self._phases.append((phase, current, peak, snapshot.compare_to(self._snapshot, 'lineno')[0:self._top]))
+        self._snapshot = snapshot
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def stop(self, last_phase: str = 'rest of the run') -> None:
+        # The final snapshot closes the last phase, which callers can name after what ran last.
+        if self._cpu is not None:
+            self._cpu.disable()
+        elif self.mode == 'memory':
+            self.snapshot(last_phase)
+            tracemalloc.stop()
+            self._snapshot = None
+
+    def print_report(self) -> None:
+        if self._cpu is not None:
+            for sort_key in ['cumulative', 'tottime']:
+                print()
+                print(f'CPU profile sorted by {sort_key}:')
+                pstats.Stats(self._cpu, stream=sys.stdout).sort_stats(sort_key).print_stats(self._top)
+
+        for phase, current, peak, stats in self._phases:
+            print()
+            print(f'Memory after {phase}: {current / 1000000:.1f} MB traced, {peak / 1000000:.1f} MB peak')
+            for stat in stats:
+                print(f'    {stat}')
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+profiler = Profiler()
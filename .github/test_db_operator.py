@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# Copyright (c) 2022 José Manuel Barroso Galindo <theypsilon@gmail.com>
+
+import copy
+import io
+import json
+import random
+import threading
+import unittest
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from db_operator import BuildVars, DownloadCache, PathIndex, diff_databases, fetch_previous_db, json_serializers
+from shared_utilities import HttpException, HttpTransport
+
+def cheats_zip(system: str, files: Dict[str, Any]) -> Dict[str, Any]:
+    zip_id = f'cheats_folder_{system.lower()}'
+    return {
+        'path': '',
+        'raw_files_size': sum(file['size'] for file in files.values()),
+        'summary_file': {'hash': zip_id, 'size': 1, 'url': f'https://example.com/{zip_id}_summary.json.zip'},
+        'summary_file_content': {
+            'files': {path: {**file, 'tags': [0], 'zip_id': zip_id} for path, file in files.items()},
+            'folders': {
+                'Cheats': {'zip_id': zip_id},
+                f'Cheats/{system}': {'zip_id': zip_id},
+            },
+        },
+    }
+
+def db_with_zips(*zip_ids: str) -> Dict[str, Any]:
+    zips = {
+        'cheats_folder_gb': cheats_zip('GB', {'Cheats/GB/a.zip': {'size': 10, 'hash': 'a'}}),
+        'cheats_folder_nes': cheats_zip('NES', {'Cheats/NES/b.zip': {'size': 20, 'hash': 'b'}}),
+    }
+    return {
+        'db_id': 'test',
+        'files': {},
+        'folders': {'Cheats': {}},
+        'zips': {zip_id: zips[zip_id] for zip_id in zip_ids},
+        'tag_dictionary': {'cheats': 0},
+    }
+
+class TestDiffDatabases(unittest.TestCase):
+    def test_diff_databases___with_zips_sharing_an_outer_folder_in_different_order___reports_no_changes(self):
+        db_diff = diff_databases(db_with_zips('cheats_folder_gb', 'cheats_folder_nes'), db_with_zips('cheats_folder_nes', 'cheats_folder_gb'))
+        for section in ['files', 'folders', 'zips']:
+            self.assertEqual({'added': [], 'removed': [], 'changed': []}, db_diff[section])
+
+    def test_diff_databases___with_a_file_changed_in_one_zip___reports_it_in_that_summary(self):
+        left = db_with_zips('cheats_folder_gb', 'cheats_folder_nes')
+        right = copy.deepcopy(left)
+        right['zips']['cheats_folder_nes']['summary_file_content']['files']['Cheats/NES/b.zip']['hash'] = 'c'
+
+        db_diff = diff_databases(left, right)
+
+        self.assertEqual([{'path': 'Cheats/NES/b.zip', 'summary': 'cheats_folder_nes', 'hash': ['b', 'c']}], db_diff['files']['changed'])
+        self.assertEqual([], db_diff['folders']['changed'])
+
+    def test_diff_databases___with_a_zip_removed___reports_its_summary_entries_as_removed(self):
+        db_diff = diff_databases(db_with_zips('cheats_folder_gb', 'cheats_folder_nes'), db_with_zips('cheats_folder_gb'))
+
+        self.assertEqual(['Cheats/NES/b.zip'], [entry['path'] for entry in db_diff['files']['removed']])
+        self.assertEqual([('cheats_folder_nes', 'Cheats'), ('cheats_folder_nes', 'Cheats/NES')], [(entry['summary'], entry['path']) for entry in db_diff['folders']['removed']])
+        self.assertEqual(-20, db_diff['totals']['size_delta'])
+
+def linear_children(keys: List[str], prefix: str, depth: int) -> Set[str]:
+    return {Path(key).parts[depth] for key in keys if key.startswith(prefix) and len(Path(key).parts) > depth}
+
+class TestPathIndex(unittest.TestCase):
+    def test_children___with_siblings_sorting_between_a_child_and_its_subtree___returns_all_of_them(self):
+        index = PathIndex({'X': {}, 'X-Y': {}, 'X/Z': {}, 'X/Z/W': {}, 'X.A/B': {}, 'Y': {}})
+        self.assertEqual({'X', 'X-Y', 'X.A', 'Y'}, index.children('', 0))
+        self.assertEqual({'Z'}, index.children('X/', 1))
+
+    def test_children___on_random_trees___matches_a_linear_scan(self):
+        rng = random.Random(0)
+        names = ['X', 'X-Y', 'X.Y', 'X Y', 'X0', 'Xa', 'x', '|games']
+        for _ in range(500):
+            keys = list({'/'.join(rng.choice(names) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 20))})
+            index = PathIndex({key: {} for key in keys})
+            for prefix, depth in [('', 0), ('X', 0), ('X/', 1), ('X/X-Y/', 2)]:
+                self.assertEqual(linear_children(keys, prefix, depth), index.children(prefix, depth), (keys, prefix, depth))
+
+class TestJsonSerializers(unittest.TestCase):
+    def test_json_serializers___on_nested_empty_and_non_ascii_values___match_json_dumps(self):
+        db = {
+            'db_id': 'test',
+            'files': {
+                'games/NES/Palettes/Ñandú ★.pal': {'hash': 'a', 'size': 0, 'tags': [0, 1]},
+                'Cheats/GB/b.zip': {'hash': 'b', 'size': 10, 'tags': [], 'zip_id': 'cheats_folder_gb'},
+            },
+            'folders': {'games': {}, 'games/NES': {'tags': [0]}},
+            'zips': {'cheats_folder_gb': {'contents': ['GB'], 'internal_summary': {'files': {}, 'folders': {'Cheats': {}}}, 'raw_files_size': 10.5}},
+            'empty_section': {},
+            'empty_list': [],
+            'base_files_url': 'https://example.com/%s/\u00e9"quoted"',
+            'timestamp': 1660000000,
+            'linux': None,
+            'default_options': {'allow_reboot': True},
+        }
+        for name, serializer in json_serializers.items():
+            for indent in [None, 4]:
+                self.assertEqual(json.dumps(db, indent=indent, sort_keys=True), ''.join(serializer(db, indent)), (name, indent))
+
+class FakeServerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests: Dict[str, int] = {}
+
+    def do_GET(self) -> None:
+        FakeServerHandler.requests[self.path] = FakeServerHandler.requests.get(self.path, 0) + 1
+        if self.path == '/db.json':
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.reply(304)
+            else:
+                self.reply(200, json.dumps({'db_id': 'test'}).encode(), {'ETag': '"v1"'})
+        elif self.path == '/moved.json':
+            self.reply(302, headers={'Location': '/db.json'})
+        elif self.path == '/flaky.json':
+            if FakeServerHandler.requests[self.path] < 3:
+                self.reply(503)
+            else:
+                self.reply(200, b'{}')
+        elif self.path == '/not_a_zip.json.zip':
+            self.reply(200, b'<html>Not Found</html>')
+        else:
+            self.reply(404)
+
+    def reply(self, status: int, body: bytes = b'', headers: Dict[str, str] = {}) -> None:
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+class TestHttpTransport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeServerHandler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        FakeServerHandler.requests = {}
+        self.transport = HttpTransport(retries=3, backoff_seconds=0)
+
+    def tearDown(self) -> None:
+        self.transport.close()
+
+    def test_get___with_the_validators_of_a_previous_response___returns_not_modified(self):
+        first = self.transport.get(f'{self.url}/db.json')
+        second = self.transport.get(f'{self.url}/db.json', validators=first.validators)
+
+        self.assertEqual((200, {'db_id': 'test'}), (first.status, json.loads(first.body)))
+        self.assertEqual((True, b''), (second.not_modified, second.body))
+
+    def test_get___on_a_redirect___returns_the_target_content(self):
+        response = self.transport.get(f'{self.url}/moved.json')
+        self.assertEqual((200, f'{self.url}/db.json', {'db_id': 'test'}), (response.status, response.url, json.loads(response.body)))
+
+    def test_get___on_server_errors___retries_until_it_succeeds(self):
+        with redirect_stdout(io.StringIO()):
+            response = self.transport.get(f'{self.url}/flaky.json')
+        self.assertEqual((200, 3), (response.status, FakeServerHandler.requests['/flaky.json']))
+
+    def test_get___on_not_found___raises_without_retrying(self):
+        with self.assertRaises(HttpException):
+            self.transport.get(f'{self.url}/missing.json')
+        self.assertEqual(1, FakeServerHandler.requests['/missing.json'])
+
+    def test_fetch_previous_db___with_a_body_that_is_not_a_zip___returns_none(self):
+        with redirect_stdout(io.StringIO()):
+            previous_db = fetch_previous_db(BuildVars(db_url=f'{self.url}/not_a_zip.json.zip'), DownloadCache(None))
+        self.assertIsNone(previous_db)
+
+if __name__ == '__main__':
+    unittest.main()